@@ -0,0 +1,195 @@
+try:
+    import argparse
+    import glob
+    import json
+    import logging
+    import os
+    from collections import namedtuple
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    print('Could not import Python standard library modules')
+
+from HRMdata import Data
+from HRMstore import ResultWriter
+
+logger = logging.getLogger(__name__)
+
+# outcome of one recording: result is the writeJSON schema dict, or None with error set if the analysis failed
+BatchResult = namedtuple('BatchResult', ['file', 'result', 'error'])
+
+
+def expandFiles(files):
+
+    """ Expands a glob pattern or a list of file names and patterns into a sorted list of files
+    :param: files (String or list) - glob pattern, or list of file names and glob patterns
+    :return: fileNames (list) - file names, patterns without any match are kept as is so they report an error
+    """
+    if isinstance(files, str):
+        files = [files]
+    fileNames = []
+    for elem in files:
+        matches = sorted(glob.glob(elem)) if glob.has_magic(elem) else []
+        fileNames.extend(matches or [elem])
+    return fileNames
+
+
+def perFile(value, fileNames, name):
+
+    """ Spreads a shared or per-file parameter over a list of files
+    :param: value - single value shared by all files, list with one value per file, or dict keyed on file name
+    :param: fileNames (list) - files of the batch
+    :param: name (String) - parameter name used in error messages
+    :raises: ValueError - if a list does not have one value per file
+    :return: values (list) - one value per file
+    """
+    if isinstance(value, dict):
+        return [value[elem] for elem in fileNames]
+    if isinstance(value, (list, tuple)):
+        if len(value) != len(fileNames):
+            raise ValueError('%s must have one value per file' % name)
+        return list(value)
+    return [value] * len(fileNames)
+
+
+def initWorker(logDir):
+
+    """ Process pool initializer that gives each worker its own log file
+    Data is built with logFile=None in the workers, so no worker truncates a log another one is writing to
+    :param: logDir (String) - directory for the hrmLog-<pid>.txt files; None disables logging in the workers
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if logDir is None:
+        root.addHandler(logging.NullHandler())
+        return
+    os.makedirs(logDir, exist_ok=True)
+    handler = logging.FileHandler(os.path.join(logDir, 'hrmLog-%d.txt' % os.getpid()), mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s', datefmt='%H:%M:%S'))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+def analyzeFile(job):
+
+    """ Analyzes one recording, catching any error so one bad file does not abort the batch
+    :param: job (tuple) - file name and dict of keyword arguments for Data
+    :return: BatchResult
+    """
+    fileName, kwargs = job
+    kwargs = dict(kwargs)
+    writeJson = kwargs.pop('writeJson', False)
+    kwargs.setdefault('logFile', None)
+    try:
+        data = Data(dataStr=fileName, lazy=True, **kwargs)
+        result = data.toDict()
+        if writeJson:
+            data.writeJSON()
+    except Exception as err:
+        logger.warning('Analysis of %s failed: %r' % (fileName, err))
+        return BatchResult(fileName, None, '%s: %s' % (type(err).__name__, err))
+    return BatchResult(fileName, result, None)
+
+
+def analyzeBatch(files, userInterval, thr=0.18, mD=200, workers=None, chunksize=1, logDir=None, writeJson=False,
+                 store=None, pool='process', outputDir=None, **kwargs):
+
+    """ Analyzes many recordings in parallel over a process pool, or a thread pool
+    userInterval, thr and mD are shared by all files, or given per file as a list or a dict keyed on file name
+    Threads skip the start up and the pickling of worker processes and share the binary cache pages; the numpy
+    stages release the GIL and run in parallel, while csv parsing and peak picking mostly hold it
+    :param: files (String or list) - glob pattern, or list of file names and glob patterns
+    :param: userInterval (int) - interval of time in seconds to analyze
+    :param: thr (double) - threshold for peak detection - default to 0.18
+    :param: mD (int) - minimum distance between peaks - default to 200
+    :param: workers (int) - number of workers, 0 runs the batch in this thread - default to os.cpu_count() processes,
+            or the ThreadPoolExecutor default for threads
+    :param: chunksize (int) - number of files handed to a worker at a time - default to 1
+    :param: logDir (String) - directory for per-worker log files (one hrmLog-<pid>.txt shared by the jobs of a
+            thread pool), None disables worker logging - default to None
+    :param: writeJson (bool) - also write the JSON file of each recording - default to False
+    :param: pool (String) - 'process' or 'thread' - default to 'process'
+    :param: outputDir (String) - directory of the JSON files, None to write them next to the recordings - default to
+            None
+    :param: store (String) - result store that the results are appended to as they arrive, see
+            HRMstore.ResultWriter - default to None
+    :param: kwargs - other keyword arguments passed to Data, e.g. corrMethod or cache
+    :raises: ValueError - if pool is not 'process' or 'thread'
+    :return: results (list) - one BatchResult per file, in input order
+    """
+    if pool not in ('process', 'thread'):
+        raise ValueError('Pool must be one of process or thread')
+    if pool == 'thread' and logDir is not None:
+        os.makedirs(logDir, exist_ok=True)
+        kwargs.setdefault('logFile', os.path.join(logDir, 'hrmLog-%d.txt' % os.getpid()))
+    if outputDir is not None:
+        kwargs['outputDir'] = outputDir
+    fileNames = expandFiles(files)
+    jobs = []
+    for fileName, interval, threshold, minDist in zip(fileNames, perFile(userInterval, fileNames, 'userInterval'),
+                                                      perFile(thr, fileNames, 'thr'), perFile(mD, fileNames, 'mD')):
+        jobKwargs = dict(kwargs, userInterval=interval, thr=threshold, mD=minDist, writeJson=writeJson)
+        jobs.append((fileName, jobKwargs))
+    logger.info('Analyzing %d files' % len(jobs))
+
+    writer = ResultWriter(store) if store is not None else None
+    try:
+        if workers == 0:
+            return collect(map(analyzeFile, jobs), writer)
+        if pool == 'thread':
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return collect(executor.map(analyzeFile, jobs), writer)
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(logDir,)) as executor:
+            return collect(executor.map(analyzeFile, jobs, chunksize=chunksize), writer)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def collect(results, writer):
+
+    """ Gathers batch results in order, appending each to the result store as it arrives
+    :param: results (iterable) - BatchResult
+    :param: writer (ResultWriter) - result store, or None
+    :return: results (list) - BatchResult
+    """
+    collected = []
+    for elem in results:
+        if writer is not None:
+            writer.append(elem.file, elem.result, elem.error)
+        collected.append(elem)
+    return collected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze many ECG csv files in parallel')
+    parser.add_argument('files', nargs='+', help='csv files or glob patterns')
+    parser.add_argument('--interval', type=float, default=10000, help='interval of time in seconds to analyze')
+    parser.add_argument('--thr', type=float, default=0.18, help='threshold for peak detection')
+    parser.add_argument('--mD', type=int, default=200, help='minimum distance between peaks')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, 0 to run in this process')
+    parser.add_argument('--chunksize', type=int, default=1, help='files handed to a worker at a time')
+    parser.add_argument('--log-dir', default=None, help='directory for per-worker log files')
+    parser.add_argument('--json', action='store_true', help='also write a JSON file next to each recording')
+    parser.add_argument('--store', default=None, help='append the results to this result store instead of printing')
+    parser.add_argument('--threads', action='store_true', help='run the workers as threads of this process')
+    parser.add_argument('--output-dir', default=None, help='directory of the JSON files written by --json')
+    parser.add_argument('--bandpass', type=float, nargs=2, default=None, metavar=('LOW', 'HIGH'),
+                        help='zero-phase bandpass cutoffs in Hz applied before the analysis')
+    parser.add_argument('--rate', type=float, default=None, help='decimate to this sample rate in Hz')
+    parser.add_argument('--cache', action='store_true', help='cache the parsed recordings in .hrmcache directories')
+    args = parser.parse_args()
+
+    results = analyzeBatch(args.files, args.interval, thr=args.thr, mD=args.mD, workers=args.workers,
+                           chunksize=args.chunksize, logDir=args.log_dir, writeJson=args.json, store=args.store,
+                           pool='thread' if args.threads else 'process', outputDir=args.output_dir,
+                           bandpass=args.bandpass, targetRate=args.rate, cache=args.cache)
+    if args.store is not None:
+        print('%d results appended to %s' % (len(results), args.store))
+        return
+    for elem in results:
+        print(json.dumps(elem._asdict()))
+
+
+if __name__ == '__main__':
+    main()
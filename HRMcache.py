@@ -0,0 +1,386 @@
+try:
+    import numpy as np
+except ImportError:
+    print('Could not import numpy')
+
+try:
+    import hashlib
+    import json
+    import logging
+    import os
+    import threading
+    from collections import OrderedDict
+except ImportError:
+    print('Could not import Python standard library modules')
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = '.hrmcache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+RESULT_MAX_ENTRIES = 4096
+RESULT_DISK_MAX_BYTES = 64 * 1024 * 1024
+
+
+def listEntries(cacheDir, suffix):
+
+    """ Lists the entries of a cache directory
+    :param: cacheDir (String) - cache directory
+    :param: suffix (String) - file name suffix of the entries
+    :return: entries - list of (last use time, size, path), oldest first
+    """
+    entries = []
+    try:
+        names = os.listdir(cacheDir)
+    except OSError:
+        return entries
+    for name in names:
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cacheDir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+    entries.sort()
+    return entries
+
+
+def evictEntries(cacheDir, maxBytes, suffix):
+
+    """ Removes the least recently used entries of a cache directory until it is within maxBytes
+    :param: cacheDir (String) - cache directory
+    :param: maxBytes (int) - size bound of the directory
+    :param: suffix (String) - file name suffix of the entries
+    :return: removed (int) - number of removed entries
+    """
+    entries = listEntries(cacheDir, suffix)
+    total = sum(elem[1] for elem in entries)
+    removed = 0
+    for lastUse, size, path in entries:
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info('Evicted %d cache entries from %s' % (removed, cacheDir))
+    return removed
+
+
+def writeAtomic(path, write):
+
+    """ Writes a file under a temporary name and renames it, so concurrent readers never see a partial file
+    :param: path (String) - final path
+    :param: write (callable) - called with the open binary file
+    :return: bool - True if the file was written
+    """
+    tempPath = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tempPath, 'wb') as out_file:
+            write(out_file)
+        os.replace(tempPath, path)
+    except OSError:
+        logger.warning('Could not write cache entry ' + path)
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        return False
+    return True
+
+
+class SampleCache:
+
+    """ On-disk binary cache of parsed ECG recordings
+    Each recording is stored as one .npy file holding a 2D float64 array, row 0 the times and the following rows
+    the centered voltages. Entries are keyed on the absolute path, modification time and size of the csv file, so an
+    edited file is parsed again. Entries are loaded with np.load(mmap_mode='r'), so repeat analyses skip text parsing
+    and processes reading the same recording share its pages
+    :param: cacheDir (String) - directory for the cache files - defaults to a .hrmcache directory next to each csv
+    :param: maxBytes (int) - size bound of a cache directory, least recently used entries are evicted past it
+
+    :attribute: hits (int) - number of loads served from the cache
+    :attribute: misses (int) - number of loads that found no entry
+    :attribute: cacheDirs (set) - cache directories this instance has read or written, emptied by clear()
+    """
+    def __init__(self, cacheDir=None, maxBytes=CACHE_MAX_BYTES):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.cacheDirs = set()
+        self.__lock = threading.Lock()
+
+    def count(self, cacheDir=None, hit=False):
+
+        """ Method that counts one load, under a lock since one cache is shared by the threads of a batch
+        :param: cacheDir (String) - cache directory used, None on a miss - default to None
+        :param: hit (bool) - True if the load was served from the cache - default to False
+        """
+        with self.__lock:
+            if cacheDir is not None:
+                self.cacheDirs.add(cacheDir)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def entryPath(self, csvName):
+
+        """ Method that builds the cache file path of a csv file from its path, mtime and size
+        :param: csvName (String) - path of the csv file
+        :return: path (String) - path of the cache entry, or None if the csv file cannot be found
+        """
+        if not isinstance(csvName, str):
+            return None
+        try:
+            stat = os.stat(csvName)
+        except OSError:
+            return None
+        fullName = os.path.abspath(csvName)
+        key = hashlib.sha1(('%s|%d|%d' % (fullName, stat.st_mtime_ns, stat.st_size)).encode()).hexdigest()[:16]
+        cacheDir = self.cacheDir or os.path.join(os.path.dirname(fullName), CACHE_DIR_NAME)
+        return os.path.join(cacheDir, '%s-%s.npy' % (os.path.basename(fullName), key))
+
+    def load(self, csvName):
+
+        """ Method that memory maps the cached samples of a csv file
+        :param: csvName (String) - path of the csv file
+        :return: samples - read-only 2D memory mapped array, or None on a cache miss
+        """
+        path = self.entryPath(csvName)
+        if path is None or not os.path.exists(path):
+            self.count()
+            return None
+        try:
+            samples = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            logger.warning('Unreadable cache entry ' + path)
+            self.count()
+            return None
+        try:
+            # the access time drives the eviction order, touch it explicitly in case of noatime mounts
+            os.utime(path)
+        except OSError:
+            pass
+        self.count(os.path.dirname(path), hit=True)
+        return samples
+
+    def store(self, csvName, samples):
+
+        """ Method that writes the parsed samples of a csv file to the cache, then evicts old entries
+        The file is written under a temporary name and renamed, so concurrent readers never see a partial entry
+        :param: csvName (String) - path of the csv file
+        :param: samples (numpy array) - 2D float64 array, times in row 0 and voltages in the following rows
+        :return: path (String) - path of the new entry, or None if it could not be written
+        """
+        path = self.entryPath(csvName)
+        if path is None:
+            return None
+        if not writeAtomic(path, lambda out_file: np.save(out_file, np.ascontiguousarray(samples, dtype=np.float64))):
+            return None
+        with self.__lock:
+            self.cacheDirs.add(os.path.dirname(path))
+        self.evict(os.path.dirname(path))
+        return path
+
+    def entries(self, cacheDir):
+
+        """ Method that lists the entries of a cache directory
+        :param: cacheDir (String) - cache directory
+        :return: entries - list of (last use time, size, path), oldest first
+        """
+        return listEntries(cacheDir, '.npy')
+
+    def evict(self, cacheDir):
+
+        """ Method that removes the least recently used entries until the directory is within maxBytes
+        :param: cacheDir (String) - cache directory
+        :return: removed (int) - number of removed entries
+        """
+        return evictEntries(cacheDir, self.maxBytes, '.npy')
+
+    def clear(self, csvName=None):
+
+        """ Method that removes cached samples
+        :param: csvName (String) - removes the cache directory of this csv file; if None, removes cacheDir and
+                every cache directory this instance has read or written, such as the .hrmcache directories of the
+                default cache
+        :return: removed (int) - number of removed entries
+        """
+        if csvName is not None:
+            path = self.entryPath(csvName)
+            if path is None:
+                return 0
+            cacheDirs = {os.path.dirname(path)}
+        else:
+            with self.__lock:
+                cacheDirs = set(self.cacheDirs)
+                self.cacheDirs.clear()
+            if self.cacheDir is not None:
+                cacheDirs.add(self.cacheDir)
+        removed = 0
+        for cacheDir in cacheDirs:
+            for lastUse, size, path in self.entries(cacheDir):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class ResultCache:
+
+    """ Cache of analysis results in front of Data
+    Results are keyed on a hash of the csv file content plus userInterval, thr, mD and any other Data parameter, so a
+    file sent again under another name is still a hit. Content hashes are remembered per path, mtime and size, so a
+    repeated request neither reads the file nor touches pandas, the correlation or peakutils. An in-memory LRU tier
+    is backed by an optional on-disk tier of small JSON files, both size bounded. Safe to share between threads
+    :param: maxEntries (int) - results kept in memory - default to RESULT_MAX_ENTRIES
+    :param: diskDir (String) - directory of the on-disk tier, None for memory only - default to None
+    :param: maxDiskBytes (int) - size bound of the on-disk tier - default to RESULT_DISK_MAX_BYTES
+
+    :attribute: hits (int) - results served from memory
+    :attribute: diskHits (int) - results served from disk
+    :attribute: misses (int) - results that had to be computed
+    """
+    def __init__(self, maxEntries=RESULT_MAX_ENTRIES, diskDir=None, maxDiskBytes=RESULT_DISK_MAX_BYTES):
+        self.maxEntries = maxEntries
+        self.diskDir = diskDir
+        self.maxDiskBytes = maxDiskBytes
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.__results = OrderedDict()
+        self.__hashes = {}
+        self.__lock = threading.Lock()
+
+    def contentHash(self, csvName):
+
+        """ Method that hashes the content of a csv file, remembered per path, mtime and size
+        :param: csvName (String) - path of the csv file
+        :raises: FileNotFoundError - if the file cannot be found
+        :return: digest (String) - hex digest of the file content
+        """
+        try:
+            stat = os.stat(csvName)
+        except OSError:
+            raise FileNotFoundError('No file with given filename found')
+        statKey = (os.path.abspath(csvName), stat.st_mtime_ns, stat.st_size)
+        digest = self.__hashes.get(statKey)
+        if digest is None:
+            contentHash = hashlib.sha1()
+            with open(csvName, 'rb') as in_file:
+                for block in iter(lambda: in_file.read(1 << 20), b''):
+                    contentHash.update(block)
+            digest = contentHash.hexdigest()
+            with self.__lock:
+                if len(self.__hashes) >= 4 * self.maxEntries:
+                    self.__hashes.clear()
+                self.__hashes[statKey] = digest
+        return digest
+
+    def key(self, csvName, userInterval, thr=0.18, mD=200, **kwargs):
+
+        """ Method that builds the cache key of an analysis
+        :return: key (String) - hex digest of the file content hash and the parameters
+        """
+        parameters = sorted(dict(kwargs, userInterval=userInterval, thr=thr, mD=mD).items())
+        return hashlib.sha1(('%s|%r' % (self.contentHash(csvName), parameters)).encode()).hexdigest()
+
+    def get(self, key):
+
+        """ Method that looks a result up in memory, then on disk
+        :param: key (String) - see key()
+        :return: dataDict (dict) - cached result, shared and not to be modified, or None on a miss
+        """
+        with self.__lock:
+            result = self.__results.get(key)
+            if result is not None:
+                self.__results.move_to_end(key)
+                self.hits += 1
+                return result
+        if self.diskDir is not None:
+            path = os.path.join(self.diskDir, key + '.json')
+            try:
+                with open(path, 'r') as in_file:
+                    result = json.load(in_file)
+                os.utime(path)
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                self.remember(key, result)
+                with self.__lock:
+                    self.diskHits += 1
+                return result
+        with self.__lock:
+            self.misses += 1
+        return None
+
+    def remember(self, key, result):
+
+        """ Method that stores a result in the in-memory tier, evicting the least recently used past maxEntries
+        """
+        with self.__lock:
+            self.__results[key] = result
+            self.__results.move_to_end(key)
+            while len(self.__results) > self.maxEntries:
+                self.__results.popitem(last=False)
+
+    def put(self, key, result):
+
+        """ Method that stores a result in both tiers
+        :param: key (String) - see key()
+        :param: result (dict) - result in the writeJSON schema
+        """
+        self.remember(key, result)
+        if self.diskDir is not None:
+            path = os.path.join(self.diskDir, key + '.json')
+            if writeAtomic(path, lambda out_file: out_file.write(json.dumps(result).encode())):
+                evictEntries(self.diskDir, self.maxDiskBytes, '.json')
+
+    def analyze(self, csvName, userInterval, thr=0.18, mD=200, **kwargs):
+
+        """ Method that returns the analysis of a csv file from the cache, or runs a lazy Data and caches it
+        :param: csvName (String) - path of the csv file
+        :param: userInterval (int) - interval of time in seconds to calculate ECG data information
+        :param: thr (double) - threshold for peak detection - default to 0.18
+        :param: mD (int) - minimum distance between peaks - default to 200
+        :param: kwargs - other keyword arguments of Data, part of the key
+        :return: dataDict (dict) - result in the writeJSON schema, shared and not to be modified
+        """
+        key = self.key(csvName, userInterval, thr, mD, **kwargs)
+        result = self.get(key)
+        if result is None:
+            from HRMdata import Data
+            options = dict(kwargs)
+            options.setdefault('logFile', None)
+            result = Data(csvName, userInterval, thr=thr, mD=mD, lazy=True, **options).toDict()
+            self.put(key, result)
+        return result
+
+    def clear(self):
+
+        """ Method that empties both tiers and resets the counters
+        """
+        with self.__lock:
+            self.__results.clear()
+            self.__hashes.clear()
+            self.hits = self.diskHits = self.misses = 0
+        if self.diskDir is not None:
+            for lastUse, size, path in listEntries(self.diskDir, '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self.__results)
+
+
+# cache used by Data(cache=True), shared by the threads of a process
+defaultCache = SampleCache()
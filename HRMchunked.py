@@ -0,0 +1,236 @@
+try:
+    import numpy as np
+except ImportError:
+    print('Could not import numpy')
+
+try:
+    import json
+    import logging
+    import os
+except ImportError:
+    print('Could not import Python standard library modules')
+
+from HRMdata import RPEAK_REFRACTORY, columnToFloat, detectRPeaks, interpolateNaN, requireModule
+
+logger = logging.getLogger(__name__)
+
+# bytes read from each end of the file to find the first and last sample times
+PEEK_BYTES = 64 * 1024
+
+
+def readChunks(fileName, chunkSize=100000):
+
+    """ Generator that parses the time column and the first lead of a csv file in chunks of rows
+    Further voltage columns of a multi-lead file are skipped, so the results describe the first lead like the
+    single-lead fields of Data
+    :param: fileName (String) - csv file to read
+    :param: chunkSize (int) - rows per chunk - default to 100000
+    :raises: FileNotFoundError - if the file cannot be found
+    :return: generator of 2D float64 arrays, times in column 0 and voltages in column 1, nan for unparseable cells
+    """
+    if not os.path.exists(fileName):
+        logger.debug('No file with given filename found')
+        raise FileNotFoundError('No file with given filename found')
+    pd = requireModule('pandas')
+    with pd.read_csv(fileName, header=None, usecols=[0, 1], chunksize=chunkSize) as reader:
+        for df in reader:
+            yield np.column_stack((columnToFloat(df.iloc[:, 0]), columnToFloat(df.iloc[:, 1])))
+
+
+def fillGaps(chunks):
+
+    """ Generator that interpolates nan cells across chunk boundaries, like interpolateNaN over the whole file
+    Rows after the last valid value of a column are held back until the next chunk brings a valid value
+    :param: chunks (iterable) - 2D float64 arrays, samples in rows
+    :return: generator of 2D float64 arrays without nan values
+    """
+    pending = None
+    previous = None
+    for chunk in chunks:
+        block = chunk if pending is None else np.concatenate((pending, chunk))
+        offset = 0 if previous is None else 1
+        if previous is not None:
+            block = np.concatenate((previous[np.newaxis], block))
+        missing = np.isnan(block)
+        if missing.all(axis=0).any():
+            # a column has no valid value yet, wait for more rows
+            pending = block[offset:]
+            continue
+        lastValid = min(np.flatnonzero(~missing[:, column])[-1] for column in range(block.shape[1]))
+        ready = block[:lastValid + 1]
+        for column in range(ready.shape[1]):
+            interpolateNaN(ready[:, column])
+        pending = block[lastValid + 1:] if lastValid + 1 < len(block) else None
+        previous = ready[-1].copy()
+        if len(ready) > offset:
+            yield ready[offset:]
+    if pending is not None and len(pending):
+        if previous is not None:
+            pending = np.concatenate((previous[np.newaxis], pending))
+        for column in range(pending.shape[1]):
+            interpolateNaN(pending[:, column])
+        yield pending[0 if previous is None else 1:]
+
+
+def peekTimes(fileName):
+
+    """ Finds the first and last valid sample times by reading only the ends of the file
+    :param: fileName (String) - csv file
+    :return: first, last (double) - sample times, nan if none could be parsed
+    """
+    def parseTimes(lines):
+        times = []
+        for line in lines:
+            try:
+                times.append(float(line.split(',')[0]))
+            except ValueError:
+                continue
+        return [elem for elem in times if elem == elem]
+
+    with open(fileName, 'rb') as in_file:
+        head = in_file.read(PEEK_BYTES).decode(errors='replace').splitlines()
+        in_file.seek(0, os.SEEK_END)
+        size = in_file.tell()
+        in_file.seek(max(size - PEEK_BYTES, 0))
+        tail = in_file.read().decode(errors='replace').splitlines()
+    if size > PEEK_BYTES:
+        # the first tail line may be cut
+        tail = tail[1:]
+    headTimes = parseTimes(head)
+    tailTimes = parseTimes(tail)
+    first = headTimes[0] if headTimes else np.nan
+    last = tailTimes[-1] if tailTimes else np.nan
+    return first, last
+
+
+def trimChunks(chunks, start, end, stats):
+
+    """ Generator that keeps the rows with a time in [start, end), while collecting whole-file statistics
+    :param: chunks (iterable) - 2D float64 arrays without nan values
+    :param: start (double) - start time of the interval
+    :param: end (double) - end time of the interval
+    :param: stats (dict) - updated in place with the sample count and voltage sum of the whole file
+    :return: generator of 2D float64 arrays
+    """
+    for chunk in chunks:
+        stats['count'] += len(chunk)
+        stats['sum'] += chunk[:, 1].sum()
+        # times are increasing, so the interval is found by binary search as in Data.modInterval
+        first, last = np.searchsorted(chunk[:, 0], [start, end], side='left')
+        if last > first:
+            yield chunk[first:last]
+
+
+def segmentBeats(segments, thr=0.18, overlap=2.0, refractory=RPEAK_REFRACTORY):
+
+    """ Generator that runs detectRPeaks on consecutive segments, carrying overlap seconds of samples across segment
+    boundaries so beats near a boundary are found with full filter context
+    A beat is kept once the following segment has been seen or the data has ended, and only if it is more than
+    refractory seconds after the previous kept beat
+    :param: segments (iterable) - 2D float64 arrays, times in column 0 and voltages in column 1
+    :param: thr (double) - normalized energy threshold of detectRPeaks - default to 0.18
+    :param: overlap (double) - seconds carried from one segment to the next - default to 2.0
+    :param: refractory (double) - minimum time between beats in seconds - default to RPEAK_REFRACTORY
+    :return: generator of numpy arrays of beat times
+    """
+    carry = None
+    lastBeat = -np.inf
+    segment = None
+    for nextSegment in segments:
+        if segment is not None:
+            beats, carry, lastBeat = detectSegment(segment, carry, thr, overlap, refractory, lastBeat, final=False)
+            yield beats
+        segment = nextSegment
+    if segment is not None:
+        beats, carry, lastBeat = detectSegment(segment, carry, thr, overlap, refractory, lastBeat, final=True)
+        yield beats
+
+
+def detectSegment(segment, carry, thr, overlap, refractory, lastBeat, final):
+
+    """ Runs detectRPeaks on one segment preceded by the carried samples, see segmentBeats
+    :return: beats, carry, lastBeat - beat times confirmed in this segment, samples to carry, last confirmed beat
+    """
+    block = segment if carry is None else np.concatenate((carry, segment))
+    times = block[:, 0]
+    peaks = detectRPeaks(times, block[:, 1] - block[:, 1].mean(), thr=thr, refractory=refractory)
+    beatTimes = times[peaks]
+    cutoff = times[-1] - overlap
+    if not final:
+        # beats in the carried tail are found again, with more context, in the next segment
+        beatTimes = beatTimes[beatTimes < cutoff]
+    confirmed = []
+    for beat in beatTimes:
+        if beat - lastBeat >= refractory:
+            confirmed.append(beat)
+            lastBeat = beat
+    # the carried samples also give the filters overlap seconds of context before the re-detected tail
+    carryFrom = np.searchsorted(times, cutoff - overlap, side='left')
+    return np.array(confirmed), block[carryFrom:], lastBeat
+
+
+def analyzeChunked(fileName, userInterval, thr=0.18, intervalStart=0, chunkSize=100000, overlap=2.0):
+
+    """ Out-of-core analysis of a long recording in constant memory
+    The csv file is parsed once in chunks through a generator pipeline: readChunks, fillGaps, trimChunks (which also
+    accumulates the whole-file mean used for centering) and segmentBeats, which detects R-peaks per chunk with overlap.
+    The interval follows Data: the duration comes from the first and last sample times, read from the ends of the
+    file, and the samples in [intervalStart, min(userInterval, duration)) are analyzed. Beats are true R-peak times
+    as with Data(beatMethod='rpeak')
+    :param: fileName (String) - csv file to analyze
+    :param: userInterval (double) - end of the analyzed interval in seconds
+    :param: thr (double) - normalized energy threshold of detectRPeaks - default to 0.18
+    :param: intervalStart (double) - start of the analyzed interval in seconds - default to 0
+    :param: chunkSize (int) - rows parsed at a time - default to 100000
+    :param: overlap (double) - seconds carried across chunk boundaries - default to 2.0
+    :raises: FileNotFoundError - if the file cannot be found
+    :raises: ValueError - if the interval contains fewer than two beats
+    :return: dataDict (dict) - same schema as Data.toDict and writeJSON
+    """
+    if not os.path.exists(fileName):
+        logger.debug('No file with given filename found')
+        raise FileNotFoundError('No file with given filename found')
+    first, last = peekTimes(fileName)
+    duration = last - first
+    end = min(userInterval, duration)
+
+    stats = {'count': 0, 'sum': 0.0}
+    extremes = [np.inf, -np.inf]
+
+    def tapExtremes(segments):
+        for segment in segments:
+            extremes[0] = min(extremes[0], segment[:, 1].min())
+            extremes[1] = max(extremes[1], segment[:, 1].max())
+            yield segment
+
+    segments = tapExtremes(trimChunks(fillGaps(readChunks(fileName, chunkSize)), intervalStart, end, stats))
+    beats = []
+    for beatTimes in segmentBeats(segments, thr=thr, overlap=overlap):
+        beats.extend(beatTimes.tolist())
+    logger.info('%s analyzed in chunks of %d rows' % (fileName, chunkSize))
+
+    if len(beats) < 2:
+        raise ValueError('Fewer than two beats found in the interval')
+    mean = stats['sum'] / stats['count']
+    return {'Mean HR (BPM)': (len(beats) - 1) * 60 / (beats[-1] - beats[0]),
+            'Voltage Extremes': [float(extremes[0] - mean), float(extremes[1] - mean)],
+            'Duration': float(duration), 'Number of Beats': len(beats), 'Beats': beats}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Analyze a long ECG csv file in constant memory')
+    parser.add_argument('file', help='csv file to analyze')
+    parser.add_argument('--interval', type=float, default=float('inf'), help='end of the interval in seconds')
+    parser.add_argument('--start', type=float, default=0, help='start of the interval in seconds')
+    parser.add_argument('--thr', type=float, default=0.18, help='energy threshold for R-peak detection')
+    parser.add_argument('--chunk', type=int, default=100000, help='rows parsed at a time')
+    args = parser.parse_args()
+
+    dataDict = analyzeChunked(args.file, args.interval, thr=args.thr, intervalStart=args.start, chunkSize=args.chunk)
+    with open(os.path.splitext(args.file)[0] + '.json', 'w') as out_file:
+        json.dump(dataDict, out_file)
+
+
+if __name__ == '__main__':
+    main()
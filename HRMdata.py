@@ -1,7 +1,3 @@
-try:
-    import pandas as pd
-except ImportError:
-    print('Could not import pandas')
 try:
     import numpy as np
 except ImportError:
@@ -12,6 +8,564 @@ try:
 except ImportError:
     print('Could not import logging')
 
+try:
+    from collections import namedtuple
+except ImportError:
+    print('Could not import namedtuple')
+
+try:
+    import HRMcache
+except ImportError:
+    print('Could not import HRMcache')
+
+try:
+    import math
+except ImportError:
+    print('Could not import math package')
+
+try:
+    import atexit
+    import importlib
+    import io
+    import json
+    import os
+    import queue
+    import re
+    import sys
+    import threading
+    import time
+    import tracemalloc
+    import weakref
+    from array import array
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    print('Could not import Python standard library modules')
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# logger of the module functions, and of Data instances built with logFile=None; configured by the application
+logger = logging.getLogger(__name__)
+
+# log files in use, keyed by absolute path, see logSink
+logSinks = {}
+logSinksLock = threading.Lock()
+
+# log files already truncated by this process, reopened in append mode
+truncatedLogs = set()
+
+# result of one autocorrelation + peak search, shared by mean_hr_bpm, num_beats and beats
+Analysis = namedtuple('Analysis', ['corr', 'peaks', 'stepSize'])
+
+# rows of the heart rate time series returned by Data.windowedHR
+WINDOW_DTYPE = np.dtype([('window_start', np.float64), ('bpm', np.float64), ('beat_count', np.int64)])
+
+# rows of the parameter grid returned by Data.sweep
+SWEEP_DTYPE = np.dtype([('thr', np.float64), ('mD', np.int64), ('mean_hr_bpm', np.float64), ('num_beats', np.int64)])
+
+# shortest time in seconds between two R-peaks kept by detectRPeaks (300 BPM)
+RPEAK_REFRACTORY = 0.2
+
+# bytes of plain numeric csv files, letters of nan and inf which np.loadtxt also parses, and empty cells, see
+# plainNumeric
+NUMERIC_BYTES = b'0123456789eE.+-, \t\r\n'
+NAN_INF_BYTES = frozenset(b'nNaAiIfFtTyY')
+EMPTY_CELL = re.compile(rb',[ \t]*(?:,|\r?\n|$)|^[ \t]*,', re.MULTILINE)
+
+# order of the Butterworth filters of preprocessLeads, doubled by the forward-backward pass
+BANDPASS_ORDER = 4
+
+# stage hooks given to every new Data instance, see Data.stage
+defaultHooks = []
+
+# signal length (in samples) from which the FFT autocorrelation is used by default, see bench_HRM.py correlate
+CORR_FFT_CUTOFF = 1024
+
+
+def correlateDirect(volt):
+
+    """ Computes the unbiased autocorrelation of a 1D signal with np.correlate, starting from time lag 0
+    O(N^2) - kept for small inputs and as the reference implementation for the FFT method
+    :param: volt (numpy array) - 1D voltage signal
+    :return: corr - numpy array of the correlation constants normalized to lag 0
+    """
+    tempCorr = np.correlate(volt, volt, mode='same')
+    N = len(tempCorr)
+    tempCorr = tempCorr[math.floor(N / 2):]
+    lengths = range(N, math.floor(N / 2), -1)
+    tempCorr /= lengths
+    tempCorr /= tempCorr[0]
+    return tempCorr
+
+
+def fastLength(n):
+
+    """ Returns the smallest 5-smooth number (2^a * 3^b * 5^c) greater than or equal to n, a fast FFT size
+    :param: n (int) - minimum transform length
+    """
+    best = 1 << max(n - 1, 0).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            # smallest power of two that brings power35 up to n
+            quotient = -(-n // power35)
+            candidate = power35 * (1 << max(quotient - 1, 0).bit_length())
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def correlateFFT(volt):
+
+    """ Computes the unbiased autocorrelation of a signal with a zero-padded FFT, starting from time lag 0
+    Gives the same output as correlateDirect in O(N log N). Works along the last axis, so a 2D array of
+    signals is correlated row by row in one batched call
+    :param: volt (numpy array) - voltage signal(s), samples along the last axis
+    :return: corr - numpy array of the correlation constants normalized to lag 0
+    """
+    volt = np.asarray(volt, dtype=np.float64)
+    N = volt.shape[-1]
+    # pad to at least 2N - 1 so the circular correlation does not wrap around
+    nfft = fastLength(2 * N - 1)
+    spectrum = np.fft.rfft(volt, nfft)
+    tempCorr = np.fft.irfft(spectrum * spectrum.conj(), nfft)[..., :N - N // 2]
+    tempCorr /= np.arange(N, N // 2, -1)
+    tempCorr /= tempCorr[..., :1]
+    return tempCorr
+
+
+def autocorrelate(volt, method='auto'):
+
+    """ Autocorrelation dispatcher used by Data.correlate and Data.correlateLeads
+    :param: volt (numpy array) - 1D voltage signal, or 2D array with one signal per row; rows are correlated in one
+            batched FFT, or one by one with the direct method
+    :param: method (String) - 'fft', 'direct' or 'auto' (fft from CORR_FFT_CUTOFF samples on)
+    :raises: ValueError - if method is not one of the above
+    :return: corr - numpy array of the correlation constants normalized to lag 0, one row per signal
+    """
+    if method == 'auto':
+        method = 'fft' if np.shape(volt)[-1] >= CORR_FFT_CUTOFF else 'direct'
+    if method == 'fft':
+        return correlateFFT(volt)
+    if method == 'direct':
+        volt = np.asarray(volt, dtype=np.float64)
+        if volt.ndim > 1:
+            return np.stack([correlateDirect(row.copy()) for row in volt])
+        return correlateDirect(volt)
+    logger.warning('Unknown correlation method')
+    raise ValueError('Correlation method must be one of auto, fft or direct')
+
+
+def movingAverage(values, width):
+
+    """ Centered moving average of a 1D array computed from a cumulative sum, same length as the input
+    :param: values (numpy array) - 1D signal
+    :param: width (double) - averaging window in samples, rounded and at least 1
+    :return: averaged - numpy array, edges padded with the nearest full window average
+    """
+    width = min(max(int(round(width)), 1), len(values))
+    cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    averaged = (cumulative[width:] - cumulative[:-width]) / width
+    pad = width - 1
+    return np.concatenate((np.full(pad // 2, averaged[0]), averaged, np.full(pad - pad // 2, averaged[-1])))
+
+
+def detectRPeaks(times, volt, thr=0.18, refractory=RPEAK_REFRACTORY):
+
+    """ Finds R-peaks directly on the voltage signal with vectorized operations
+    The signal is band-passed (difference of ~33 ms and ~500 ms moving averages), differentiated, squared and
+    integrated over 150 ms. Regions where that energy is above thr of its range (the peakutils threshold semantics)
+    each give one candidate, the band-passed maximum of the region. Candidates closer than refractory seconds keep
+    the highest one. The sample rate is the mean spacing of times, so irregular sampling only shifts the filter widths
+    :param: times (numpy array) - sample times
+    :param: volt (numpy array) - centered voltage signal
+    :param: thr (double) - normalized energy threshold between 0 and 1 - default to 0.18
+    :param: refractory (double) - minimum time between beats in seconds - default to RPEAK_REFRACTORY
+    :return: indices - numpy array of the R-peak sample indices, map them through times for the beat times
+    """
+    if len(volt) < 3:
+        return np.empty(0, dtype=np.int64)
+    fs = (len(times) - 1) / (times[-1] - times[0])
+    band = movingAverage(volt, fs / 30) - movingAverage(volt, fs / 2)
+    energy = movingAverage(np.gradient(band) ** 2, 0.15 * fs)
+    above = energy > thr * (energy.max() - energy.min()) + energy.min()
+
+    # label each run of samples above the threshold, then take the band-passed maximum of every run
+    candidates = np.flatnonzero(above)
+    if not len(candidates):
+        return np.empty(0, dtype=np.int64)
+    regionId = np.cumsum(above & ~np.concatenate(([False], above[:-1])))[candidates]
+    order = np.lexsort((-band[candidates], regionId))
+    firstOfRegion = np.concatenate(([True], np.diff(regionId[order]) != 0))
+    peaks = candidates[order][firstOfRegion]
+
+    # refractory suppression, only loops over the candidate peaks
+    minSamples = refractory * fs
+    kept = [peaks[0]]
+    for peak in peaks[1:]:
+        if peak - kept[-1] >= minSamples:
+            kept.append(peak)
+        elif band[peak] > band[kept[-1]]:
+            kept[-1] = peak
+    return np.array(kept, dtype=np.int64)
+
+
+class Result:
+
+    """ Compact record of the results of one recording, as exported by Data.export
+    Slots instead of an instance dict, plain floats, and beat times in one array('d') keep a retained result to a
+    few hundred bytes, against the whole parsed recording held by a Data instance. For a multi-lead recording the
+    fields describe the first lead
+    :param: file (String) - analyzed recording
+    :param: mean_hr_bpm (double) - average heart rate
+    :param: voltage_extremes (tuple) - min and max voltage
+    :param: duration (double) - duration of the recording
+    :param: num_beats (int) - number of beats
+    :param: beats (array like) - beat times, stored as array('d')
+    """
+    __slots__ = ('file', 'mean_hr_bpm', 'voltage_min', 'voltage_max', 'duration', 'num_beats', 'beats')
+
+    def __init__(self, file, mean_hr_bpm, voltage_extremes, duration, num_beats, beats):
+        self.file = file
+        self.mean_hr_bpm = float(mean_hr_bpm)
+        self.voltage_min = float(voltage_extremes[0])
+        self.voltage_max = float(voltage_extremes[1])
+        self.duration = float(duration)
+        self.num_beats = int(num_beats)
+        self.beats = beats if isinstance(beats, array) else array('d', np.asarray(beats, dtype=np.float64).tobytes())
+
+    @property
+    def voltage_extremes(self):
+        return self.voltage_min, self.voltage_max
+
+    def toDict(self):
+
+        """ Method that rebuilds the writeJSON schema
+        :return: dataDict (dict) - mean HR, voltage extremes, duration, number of beats and beats
+        """
+        return {'Mean HR (BPM)': self.mean_hr_bpm, 'Voltage Extremes': [self.voltage_min, self.voltage_max],
+                'Duration': self.duration, 'Number of Beats': self.num_beats, 'Beats': self.beats.tolist()}
+
+    def __repr__(self):
+        return 'Result(%r, mean_hr_bpm=%.2f, num_beats=%d)' % (self.file, self.mean_hr_bpm, self.num_beats)
+
+
+# modules fully imported by requireModule
+importedModules = set()
+importLock = threading.Lock()
+
+
+def requireModule(name):
+
+    """ Imports a heavy dependency (pandas, peakutils and the scipy it loads) the first time a code path needs it,
+    so importing this module and analyzing plain csv files stays fast for short-lived processes
+    :param: name (String) - module name
+    :raises: ImportError - if the module cannot be imported
+    :return: module
+    """
+    module = sys.modules.get(name)
+    if module is None or name not in importedModules:
+        # a module is in sys.modules while another thread is still running its body, so wait for that import
+        with importLock:
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                print('Could not import ' + name)
+                logger.error('Could not import ' + name)
+                raise
+            importedModules.add(name)
+    return module
+
+
+class LogSink:
+
+    """ Log file shared by the Data instances logging to it
+    Analysis threads only put records on a queue and one listener thread writes them, so logging never blocks on
+    file I/O. The listener is stopped and the file closed when its last instance goes away, see releaseSink
+    :param: path (String) - absolute path of the log file
+
+    :attribute: handler (logging.handlers.QueueHandler) - handler of the instance loggers
+    :attribute: users (int) - number of instances logging to the file
+    """
+    __slots__ = ('path', 'handler', 'users', 'fileHandler', 'listener')
+
+    def __init__(self, path):
+        self.path = path
+        self.users = 0
+        records = queue.SimpleQueue()
+        self.fileHandler = logging.FileHandler(path, mode='a' if path in truncatedLogs else 'w')
+        truncatedLogs.add(path)
+        self.fileHandler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s',
+                                                        datefmt='%H:%M:%S'))
+        self.listener = QueueListener(records, self.fileHandler)
+        self.listener.start()
+        self.handler = QueueHandler(records)
+
+    def close(self):
+
+        """ Method that writes the queued records, stops the listener thread and closes the file
+        """
+        self.listener.stop()
+        self.fileHandler.close()
+
+
+def logSink(logFile):
+
+    """ Returns the QueueHandler that writes to a log file, opening the file and starting its listener on first use
+    The file is truncated when first opened by the process and shared by every Data instance logging to it. Each
+    call must be matched by a releaseSink call
+    :param: logFile (String) - log file
+    :return: handler (logging.handlers.QueueHandler)
+    """
+    path = os.path.abspath(logFile)
+    with logSinksLock:
+        sink = logSinks.get(path)
+        if sink is None:
+            sink = logSinks[path] = LogSink(path)
+        sink.users += 1
+        return sink.handler
+
+
+def releaseSink(logFile):
+
+    """ Drops one user of a log file, closing it once no Data instance logs to it
+    :param: logFile (String) - log file, as given to logSink
+    """
+    path = os.path.abspath(logFile)
+    with logSinksLock:
+        sink = logSinks.get(path)
+        if sink is None:
+            return
+        sink.users -= 1
+        if sink.users > 0:
+            return
+        del logSinks[path]
+    sink.close()
+
+
+@atexit.register
+def closeSinks():
+
+    """ Closes the log files still in use at exit, so their queued records are written
+    """
+    with logSinksLock:
+        sinks = list(logSinks.values())
+        logSinks.clear()
+    for sink in sinks:
+        sink.close()
+
+
+def dataLogger(owner, name, logFile):
+
+    """ Returns the logger of one Data instance
+    :param: owner (object) - instance the logger belongs to, the log file is released when it is garbage collected
+    :param: name (String) - name of the analyzed recording, shown in every record
+    :param: logFile (String) - log file; None gives the module logger, left to the logging configuration of the
+            application
+    :return: logger (logging.Logger) - not registered with the logging module, so it is freed with the instance
+    """
+    if logFile is None:
+        return logger
+    logFile = os.path.abspath(logFile)
+    instanceLogger = logging.Logger('HRMdata %s' % name)
+    instanceLogger.setLevel(logging.DEBUG)
+    instanceLogger.addHandler(logSink(logFile))
+    weakref.finalize(owner, releaseSink, logFile)
+    return instanceLogger
+
+
+def memoryUsage():
+
+    """ Returns the memory used by the process in bytes, as reported to stage hooks
+    The bytes allocated by Python when tracemalloc is tracing, else the resident set size (the peak resident set
+    size on systems without /proc)
+    :return: usage (int) - bytes
+    """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open('/proc/self/statm', 'r') as in_file:
+            return int(in_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+class StageTimer:
+
+    """ Context manager that times one pipeline stage of a Data instance
+    The seconds are added to data.timings[name]. If the instance has hooks, each is then called with the stage name,
+    the seconds, the number of samples held after the stage and the change in memoryUsage() over the stage.
+    Without hooks the cost is two perf_counter calls, so timing can stay on in production. A stage that raises is
+    not recorded
+    :param: data (Data) - instance being timed
+    :param: name (String) - stage name
+    """
+    __slots__ = ('data', 'name', 'start', 'memory')
+
+    def __init__(self, data, name):
+        self.data = data
+        self.name = name
+
+    def __enter__(self):
+        self.memory = memoryUsage() if self.data.hooks else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        seconds = time.perf_counter() - self.start
+        if excType is not None:
+            return False
+        data = self.data
+        data.timings[self.name] = data.timings.get(self.name, 0.0) + seconds
+        if data.hooks:
+            memoryDelta = memoryUsage() - self.memory
+            if data.times is not None:
+                samples = len(data.times)
+            elif data.csvSamples is not None:
+                samples = len(data.csvSamples)
+            elif data.csvDf is not None:
+                samples = len(data.csvDf)
+            else:
+                samples = 0
+            for hook in data.hooks:
+                hook(self.name, seconds, samples, memoryDelta)
+        return False
+
+
+def columnToFloat(column):
+
+    """ Converts a dataframe column to a writable, contiguous float64 numpy array
+    String cells (only present if pandas could not parse the column as floats) are changed to nan
+    :param: column (Pandas Series) - column read from the csv file
+    :return: values - float64 numpy array owning its data
+    """
+    if column.dtype != np.float64:
+        column = requireModule('pandas').to_numeric(column, errors='coerce')
+    return np.array(column.to_numpy(dtype=np.float64), dtype=np.float64, order='C')
+
+
+def interpolateNaN(values):
+
+    """ Linearly interpolates nan values of a 1D float array in place, by sample position
+    nan values before the first or after the last valid sample take the nearest valid value
+    :param: values (numpy array) - float64 array, modified in place
+    :return: values - the same array
+    """
+    missing = np.isnan(values)
+    if missing.any() and not missing.all():
+        positions = np.flatnonzero(missing)
+        valid = np.flatnonzero(~missing)
+        values[positions] = np.interp(positions, valid, values[valid])
+    return values
+
+
+def interpolateLeads(leads):
+
+    """ Interpolates the nan values of every row of a 2D array in place, see interpolateNaN
+    Rows without nan values, the usual case, are found in one pass and left alone
+    :param: leads (numpy array) - 2D float64 array, one signal per row
+    :return: leads - the same array
+    """
+    for index in np.flatnonzero(np.isnan(leads).any(axis=1)):
+        interpolateNaN(leads[index])
+    return leads
+
+
+def plainNumeric(content):
+
+    """ Tells whether np.loadtxt can parse csv content, in one pass over its bytes instead of a parse that stops
+    at the first string or missing cell
+    :param: content (bytes) - csv file content
+    :return: bool - False if a cell holds a string or is empty
+    """
+    leftover = content.translate(None, NUMERIC_BYTES)
+    if leftover and not NAN_INF_BYTES.issuperset(leftover):
+        return False
+    return EMPTY_CELL.search(content) is None
+
+
+def uniformGrid(times, leads):
+
+    """ Resamples leads sampled at irregular times onto a uniform grid over the same time range, by linear
+    interpolation. The neighbours and weights of the grid points are found once and shared by every lead
+    :param: times (numpy array) - increasing sample times
+    :param: leads (numpy array) - 2D array, one signal per row and a column per time
+    :return: grid (numpy array) - uniform times, leads (numpy array) - resampled signals
+    """
+    count = len(times)
+    grid = times[0] + (times[-1] - times[0]) / (count - 1) * np.arange(count)
+    right = np.clip(np.searchsorted(times, grid, side='right'), 1, count - 1)
+    left = right - 1
+    span = times[right] - times[left]
+    weight = np.divide(grid - times[left], span, out=np.zeros(count), where=span > 0)
+    return grid, leads[:, left] + weight * (leads[:, right] - leads[:, left])
+
+
+def preprocessLeads(times, leads, bandpass=None, targetRate=None, uniform=False, order=BANDPASS_ORDER):
+
+    """ Conditions the signals before the autocorrelation and peak search, all leads at once along the last axis
+    Irregular times are first resampled onto a uniform grid, see uniformGrid. Decimation keeps every factor-th sample,
+    factor the largest integer that keeps the rate at or above targetRate, after the polyphase anti-aliasing filter
+    of scipy.signal.resample_poly. The bandpass is a zero-phase Butterworth filter (scipy.signal.sosfiltfilt) applied
+    after decimation, where it is cheaper; a low cutoff removes the baseline wander, a high cutoff the muscle and
+    mains noise. A cutoff at or above the Nyquist frequency of the decimated signal is skipped with a warning. The
+    signals are centered again at the end
+    :param: times (numpy array) - increasing sample times
+    :param: leads (numpy array) - 2D array, one signal per row and a column per time
+    :param: bandpass (tuple) - (low, high) cutoffs in Hz, either may be None for a high-pass or low-pass filter -
+            default to None
+    :param: targetRate (double) - lowest sample rate in Hz to decimate to, implies uniform - default to None
+    :param: uniform (bool) - resample onto a uniform grid - default to False
+    :param: order (int) - Butterworth filter order - default to BANDPASS_ORDER
+    :return: times (numpy array), leads (numpy array) - new arrays, the inputs are not modified, factor (int) -
+            decimation factor, 1 without decimation
+    """
+    factor = 1
+    if len(times) < 2:
+        return times, leads, factor
+    if uniform or targetRate is not None:
+        times, leads = uniformGrid(times, leads)
+    rate = (len(times) - 1) / (times[-1] - times[0])
+
+    if targetRate is not None:
+        factor = max(int(rate // targetRate), 1)
+        if factor > 1:
+            signal = requireModule('scipy.signal')
+            leads = signal.resample_poly(leads, 1, factor, axis=-1)
+            times = times[::factor]
+            rate /= factor
+
+    if bandpass is not None:
+        low, high = bandpass
+        if high is not None and high >= rate / 2:
+            logger.warning('Bandpass high cutoff %g Hz is above the Nyquist frequency, skipped' % high)
+            high = None
+        if low is not None and low >= rate / 2:
+            logger.warning('Bandpass low cutoff %g Hz is above the Nyquist frequency, skipped' % low)
+            low = None
+        if low or high:
+            signal = requireModule('scipy.signal')
+            if low and high:
+                sos = signal.butter(order, [low, high], btype='bandpass', fs=rate, output='sos')
+            elif low:
+                sos = signal.butter(order, low, btype='highpass', fs=rate, output='sos')
+            else:
+                sos = signal.butter(order, high, btype='lowpass', fs=rate, output='sos')
+            # pad by three periods of the low cutoff so the edge transients settle before the signal
+            padlen = min(int(3 * rate / low) if low else 3 * (2 * len(sos) + 1), leads.shape[-1] - 1)
+            leads = signal.sosfiltfilt(sos, leads, axis=-1, padlen=padlen)
+
+    leads = leads - leads.mean(axis=1, keepdims=True)
+    return np.ascontiguousarray(times), leads, factor
+
+
 class Data:
 
     """ Defines the HRMData class
@@ -21,50 +575,131 @@ class Data:
     :param: userInterval (int) - user input interval of time in seconds to calculate ECG data information
     :param: thr (double) - user input threshold for peak detection - default to 0.18
     :param: mD (int) - user input mininum distance between peaks - default to 200
+    :param: corrMethod (String) - autocorrelation backend, 'auto', 'fft' or 'direct' - default to 'auto'
+    :param: beatMethod (String) - 'autocorr' estimates the beats from the autocorrelation peaks, 'rpeak' detects
+                every R-peak on the voltage with detectRPeaks (thr is then the energy threshold) - default to 'autocorr'
+    :param: lazy (bool) - if True, only validates the inputs; the csv file is parsed and each metric computed the
+                first time it is read, and no JSON file is written - default to False
+    :param: cache (bool or HRMcache.SampleCache) - binary cache of the parsed samples, written to a .hrmcache
+                directory next to each csv file; True uses HRMcache.defaultCache, False bypasses it - default to
+                False
+    :param: logFile (String) - log file of this instance, written through a queue and shared with the other
+                instances logging to it, truncated when first opened by the process and closed once none of them
+                is left, see LogSink; None logs to the HRMdata logger of the logging configuration of the
+                application - default to None
+    :param: outputDir (String) - directory of the JSON file, None to write it next to the csv file - default to None
+    :param: intervalStart (double) - start in seconds of the analyzed window [intervalStart, userInterval) -
+                default to 0
+    :param: reader (String) - csv parser, 'numpy' for plain numeric files, 'pandas' for any file, or 'auto' to use
+                numpy unless one scan of the file finds string or missing cells, then pandas - default to 'auto'
+    :param: hooks (list) - callables called as hook(stage, seconds, samples, memoryDelta) after each pipeline
+                stage, see stage() - default to a copy of defaultHooks
+    :param: bandpass (tuple) - (low, high) cutoffs in Hz of a zero-phase filter applied to the trimmed signal,
+                either may be None, see preprocessLeads - default to None
+    :param: targetRate (double) - lowest sample rate in Hz the trimmed signal is decimated to; mD keeps counting
+                samples of the recorded signal and is divided by the decimation factor for the peak search - default
+                to None
+    :param: uniform (bool) - resample the trimmed signal onto uniform times - default to False
 
     :attribute: csvFile (String) - name of desired CSV file, set to dataStr
-    :attribute: csvDf (Pandas Dataframe) - dataframe containing csv file information
-    :attribute: times (numpy array) - contains times of ECG data from Dataframe
-    :attribute: volt (numpy array) - contains voltage information of ECG data from Dataframe
+    :attribute: csvDf (Pandas Dataframe) - dataframe containing csv file information, None if the samples were
+                loaded from the cache or parsed by numpy
+    :attribute: csvSamples (numpy array) - 2D array of the csv file parsed by numpy, None otherwise and once
+                extract_data has copied it to times and leads
+    :attribute: times (numpy array) - contains times of ECG data from Dataframe, None until load() in lazy mode;
+                uniform and decimated when preprocessing asks for it
+    :attribute: volt (numpy array) - contains voltage information of ECG data from Dataframe, None until load()
+                in lazy mode; the first lead of a multi-lead file
+    :attribute: leads (numpy array) - 2D array of the centered voltages, one row per lead and a column per time,
+                None until load() in lazy mode
+    :attribute: numLeads (int) - number of voltage columns of the file
+    :attribute: lead_mean_hr_bpm (numpy array) - average heart rate of each lead, nan for a lead with fewer than two
+                beats
+    :attribute: lead_voltage_extremes (numpy array) - min and max voltage of each lead, one row per lead
+    :attribute: lead_num_beats (numpy array) - number of detected beats of each lead
+    :attribute: consensus_hr_bpm (double) - median of the lead heart rates
     :attribute: mean_hr_bpm (double) - avg heart rate over specified interval
     :attribute: voltage_extremes (tuple) - contains min and max lead voltages of data
     :attribute: duration (double) - time duration of ECG strip
     :attribute: num_beats (int) - number of detected beats in ECG strip
     :attribute: beats (numpy array) - time when a beat occured
+    :attribute: correlation (numpy array) - cached output of correlate(), reset when volt or interval change
+    :attribute: analysis (Analysis) - cached correlation, peak indices and step size, reset when threshold,
+                minDist, volt or interval change
+    :attribute: rpeaks (numpy array) - cached R-peak indices from detectRPeaks, reset when threshold, volt or
+                interval change
+    :attribute: timings (dict) - seconds spent in each pipeline stage run so far, keyed by stage name
+    :attribute: logger (logging.Logger) - logger of this instance, see dataLogger
+
+    Construction has no effect outside the instance unless a logFile is given, so instances may be built and
+    analyzed concurrently from a thread pool, the numpy stages running in parallel. One instance may also be
+    shared between threads: loading and each cached analysis are computed once under a per-instance lock
 
     """
-    def __init__(self, dataStr, userInterval, thr=0.18, mD=200):
-        logging.basicConfig(filename='hrmLog.txt', level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s',
-                            datefmt='%H:%M:%S')
-        with open('hrmLog.txt', 'w'):
-            pass
+    def __init__(self, dataStr, userInterval, thr=0.18, mD=200, corrMethod='auto', lazy=False, cache=False,
+                 logFile=None, beatMethod='autocorr', intervalStart=0, hooks=None, reader='auto',
+                 outputDir=None, bandpass=None, targetRate=None, uniform=False):
+        self.logger = dataLogger(self, dataStr, logFile)
+        self.__lock = threading.RLock()
+        self.__corr = None
+        self.__analysis = None
+        self.__rpeaks = None
+        self.__leadCorr = None
+        self.__leadPeaks = None
+        self.__volt = None
+        self.__leads = None
+        self.__loaded = False
+        self.__duration = None
+        self.__interval = None
+        self.__voltage_extremes = None
+        self.__mean_hr_bpm = None
+        self.__num_beats = None
+        self.__beats = None
+        self.__decimation = 1
+        self.timings = {}
+        self.hooks = list(defaultHooks if hooks is None else hooks)
 
         self.userInterval = userInterval
+        self.intervalStart = intervalStart
         self.threshold = thr
         self.minDist = mD
+        self.corrMethod = corrMethod
+        self.beatMethod = beatMethod
+        self.reader = reader
+        self.bandpass = bandpass
+        self.targetRate = targetRate
+        self.uniform = uniform
 
         self.checkInterval()
         self.checkMD()
         self.checkThres()
+        self.checkCorrMethod()
+        self.checkBeatMethod()
+        self.checkReader()
+        self.checkPreprocess()
 
+        self.lazy = lazy
+        if cache is True:
+            cache = HRMcache.defaultCache
+        self.cache = cache or None
         self.csvName = dataStr
+        self.outputDir = outputDir
         self.csvDf = None
+        self.csvSamples = None
         self.times = None
-        self.volt = None
-        self.read_csv()
-        logging.info('csv file has been read')
-        self.extract_data()
-        logging.info('voltage and time values have been extracted')
-        self.duration = None
-        self.interval = None
-        self.modInterval()
+        self.leads = None
+        if self.lazy:
+            self.logger.info('Lazy mode, analysis deferred until first use')
+            return
+
+        self.load()
         self.voltage_extremes = None
         self.mean_hr_bpm = None
         self.num_beats = None
         self.beats = None
-        logging.info('All attributes have been computed')
+        self.logger.info('All attributes have been computed')
         self.writeJSON()
-        logging.info('json file has been written')
+        self.logger.info('json file has been written')
 
     def checkThres(self):
 
@@ -83,11 +718,143 @@ class Data:
 
         if self.threshold <= 0:
             print('Threshold must be greater than 0')
-            logging.debug('Threshold input must be greater than 0')
+            self.logger.debug('Threshold input must be greater than 0')
             raise ValueError('Threshold input must be greater than 0')
-        logging.info('Input threshold has been checked')
+        self.logger.info('Input threshold has been checked')
+        return
+
+    def checkCorrMethod(self):
+
+        """ Method to check if the autocorrelation backend is valid
+        :param: self - contains the corrMethod attribute
+        :raises: ValueError - if corrMethod is not 'auto', 'fft' or 'direct'
+        :return: None
+        """
+        if self.corrMethod not in ('auto', 'fft', 'direct'):
+            self.logger.warning('Unknown correlation method')
+            raise ValueError('Correlation method must be one of auto, fft or direct')
+        self.logger.info('Correlation method has been checked')
+        return
+
+    def checkBeatMethod(self):
+
+        """ Method to check if the beat detection method is valid
+        :param: self - contains the beatMethod attribute
+        :raises: ValueError - if beatMethod is not 'autocorr' or 'rpeak'
+        :return: None
+        """
+        if self.beatMethod not in ('autocorr', 'rpeak'):
+            self.logger.warning('Unknown beat detection method')
+            raise ValueError('Beat detection method must be one of autocorr or rpeak')
+        self.logger.info('Beat detection method has been checked')
+        return
+
+    def checkReader(self):
+
+        """ Method to check if the csv parser is valid
+        :param: self - contains the reader attribute
+        :raises: ValueError - if reader is not 'auto', 'numpy' or 'pandas'
+        :return: None
+        """
+        if self.reader not in ('auto', 'numpy', 'pandas'):
+            self.logger.warning('Unknown csv reader')
+            raise ValueError('Reader must be one of auto, numpy or pandas')
+        self.logger.info('Reader has been checked')
+        return
+
+    def checkPreprocess(self):
+
+        """ Method to check if the preprocessing options are valid
+        :param: self - contains the bandpass and targetRate attributes
+        :raises: ValueError - if bandpass is not a (low, high) pair of positive cutoffs with low below high, or
+                targetRate is not greater than 0
+        :return: None
+        """
+        if self.bandpass is not None:
+            try:
+                low, high = self.bandpass
+            except (TypeError, ValueError):
+                self.logger.warning('Bandpass is not a pair of cutoffs')
+                raise ValueError('Bandpass must be a (low, high) pair of cutoffs in Hz')
+            if any(elem is not None and not elem > 0 for elem in (low, high)) or \
+                    (low is not None and high is not None and low >= high):
+                self.logger.warning('Invalid bandpass cutoffs')
+                raise ValueError('Bandpass cutoffs must be greater than 0, low below high')
+        if self.targetRate is not None and not self.targetRate > 0:
+            self.logger.warning('Target sample rate must be greater than 0')
+            raise ValueError('Target sample rate must be greater than 0')
+        self.logger.info('Preprocessing options have been checked')
         return
 
+    def load(self):
+
+        """ Method that reads the csv file, extracts the data, trims it to the interval and preprocesses it, once
+        per instance
+        Called by the constructor, or on first access to a metric in lazy mode. Samples already set, as by
+        fromSamples, are trimmed without reading any file
+        """
+        with self.__lock:
+            if self.__loaded:
+                return
+            if self.times is not None:
+                loaded = True
+            else:
+                with self.stage('loadCache'):
+                    loaded = self.loadCache()
+            if not loaded:
+                with self.stage('read_csv'):
+                    self.read_csv()
+                self.logger.info('csv file has been read')
+                with self.stage('extract_data'):
+                    self.extract_data()
+                self.logger.info('voltage and time values have been extracted')
+                with self.stage('storeCache'):
+                    self.storeCache()
+            self.duration = None
+            self.interval = None
+            with self.stage('modInterval'):
+                self.modInterval()
+            self.__decimation = 1
+            if self.bandpass is not None or self.targetRate is not None or self.uniform:
+                with self.stage('preprocess'):
+                    self.preprocess()
+                self.logger.info('Signal has been preprocessed')
+            self.__loaded = True
+
+    def stage(self, name):
+
+        """ Returns a context manager that times one pipeline stage, see StageTimer
+        :param: name (String) - stage name, one of loadCache, read_csv, extract_data, storeCache, modInterval,
+                preprocess, correlate, findPeaks, detectRPeaks or writeJSON
+        :return: timer (StageTimer)
+        """
+        return StageTimer(self, name)
+
+    @classmethod
+    def fromSamples(cls, times, volt, userInterval, **kwargs):
+
+        """ Builds a lazy Data instance from samples in memory instead of a csv file
+        nan values are interpolated and the voltage centered as in extract_data
+        :param: times (array like) - sample times
+        :param: volt (array like) - sample voltages, same length as times, or one row of voltages per lead
+        :param: userInterval (int) - interval of time in seconds to calculate ECG data information
+        :param: kwargs - other keyword arguments of Data, e.g. thr, mD or beatMethod
+        :raises: ValueError - if times and volt differ in length or hold fewer than two samples
+        :return: data (Data) - lazy instance, no csv file is read and no JSON file written
+        """
+        times = np.array(times, dtype=np.float64).ravel()
+        leads = np.array(volt, dtype=np.float64, ndmin=2)
+        if leads.ndim != 2 or len(times) != leads.shape[1] or len(times) < 2:
+            raise ValueError('times and volt must have the same length, at least 2 samples')
+        kwargs.update(lazy=True, cache=False)
+        data = cls(None, userInterval, **kwargs)
+        interpolateNaN(times)
+        interpolateLeads(leads)
+        leads -= leads.mean(axis=1, keepdims=True)
+        data.times = times
+        data.leads = leads
+        return data
+
     def checkInterval(self):
 
         """ Method to check if user input threshold is valid
@@ -97,16 +864,25 @@ class Data:
         :return: None
         """
         if self.userInterval < 0:
-            logging.warning('Cannot input negative interval of time')
+            self.logger.warning('Cannot input negative interval of time')
             raise ValueError('Cannot input negative interval of time')
         try:
             self.userInterval + 25
         except TypeError:
             print('Input must be a number')
-            logging.warning('Input entered was not a number')
+            self.logger.warning('Input entered was not a number')
             raise TypeError
             return None
-        logging.info('Input interval has been checked')
+        try:
+            self.intervalStart + 25
+        except TypeError:
+            print('Interval start must be a number')
+            self.logger.warning('Interval start entered was not a number')
+            raise TypeError('Interval start must be a number')
+        if self.intervalStart < 0 or (self.intervalStart > 0 and self.intervalStart >= self.userInterval):
+            self.logger.warning('Interval start must be between 0 and the end of the interval')
+            raise ValueError('Interval start must be between 0 and the end of the interval')
+        self.logger.info('Input interval has been checked')
         return
 
     def checkMD(self):
@@ -126,14 +902,16 @@ class Data:
 
         if self.minDist <= 0:
             print('Minimum distance between peaks must be greater than 0')
-            logging.debug('Min distance between peaks must be greater than 0')
+            self.logger.debug('Min distance between peaks must be greater than 0')
             raise ValueError
             return None
-        logging.info('Min dist input has been checked')
+        self.logger.info('Min dist input has been checked')
         return
 
     @property
     def interval(self):
+        if self.__interval is None:
+            self.load()
         return self.__interval
 
     @interval.setter
@@ -142,6 +920,142 @@ class Data:
             self.__interval = self.duration
         else:
             self.__interval = self.userInterval
+        self.resetAnalysis()
+
+    @property
+    def threshold(self):
+        return self.__threshold
+
+    @threshold.setter
+    def threshold(self, threshold):
+        self.__threshold = threshold
+        self.__analysis = None
+        self.__rpeaks = None
+        self.__leadPeaks = None
+        self.resetBeats()
+
+    @property
+    def minDist(self):
+        return self.__minDist
+
+    @minDist.setter
+    def minDist(self, minDist):
+        self.__minDist = minDist
+        self.__analysis = None
+        self.__leadPeaks = None
+        self.resetBeats()
+
+    @property
+    def volt(self):
+        return self.__volt
+
+    @volt.setter
+    def volt(self, volt):
+        # a single lead
+        self.__volt = volt
+        self.__leads = None if volt is None else volt[np.newaxis]
+        self.resetAnalysis()
+
+    @property
+    def leads(self):
+        return self.__leads
+
+    @leads.setter
+    def leads(self, leads):
+        self.__leads = leads
+        self.__volt = None if leads is None else leads[0]
+        self.resetAnalysis()
+
+    @property
+    def numLeads(self):
+        if self.leads is None:
+            self.load()
+        return len(self.leads)
+
+    def resetAnalysis(self):
+
+        """ Method that drops the cached correlation, peak analysis and every attribute derived from the samples,
+        so they are recomputed on next use
+        """
+        self.__corr = None
+        self.__analysis = None
+        self.__rpeaks = None
+        self.__leadCorr = None
+        self.__leadPeaks = None
+        self.__voltage_extremes = None
+        self.resetBeats()
+
+    def resetBeats(self):
+
+        """ Method that drops the memoized mean_hr_bpm, num_beats and beats, after a change of the peak search
+        """
+        self.__mean_hr_bpm = None
+        self.__num_beats = None
+        self.__beats = None
+
+    @property
+    def correlation(self):
+        with self.__lock:
+            if self.__corr is None:
+                if len(self.leads) > 1:
+                    # first row of the batched correlation of all leads
+                    self.__corr = self.leadCorrelation[0]
+                else:
+                    with self.stage('correlate'):
+                        self.__corr = self.correlate()
+            return self.__corr
+
+    @property
+    def leadCorrelation(self):
+        with self.__lock:
+            if self.__leadCorr is None:
+                if len(self.leads) > 1:
+                    with self.stage('correlate'):
+                        self.__leadCorr = self.correlateLeads()
+                else:
+                    self.__leadCorr = self.correlation[np.newaxis]
+            return self.__leadCorr
+
+    @property
+    def leadPeaks(self):
+
+        """ Beat indices of each lead: autocorrelation peak indices of each row of leadCorrelation, or R-peak
+        indices of each lead with beatMethod 'rpeak'
+        """
+        with self.__lock:
+            if self.__leadPeaks is None:
+                if self.beatMethod == 'rpeak':
+                    with self.stage('detectRPeaks'):
+                        self.__leadPeaks = [detectRPeaks(self.times, lead, thr=self.threshold)
+                                            for lead in self.leads]
+                else:
+                    corr = self.leadCorrelation
+                    peakutils = requireModule('peakutils')
+                    with self.stage('findPeaks'):
+                        self.__leadPeaks = [peakutils.indexes(row, thres=self.threshold,
+                                                              min_dist=self.peakDistance()) for row in corr]
+            return self.__leadPeaks
+
+    @property
+    def analysis(self):
+
+        """ Correlation, peak indices and step size, computed once and shared by all derived attributes
+        """
+        with self.__lock:
+            if self.__analysis is None:
+                corr = self.correlation
+                with self.stage('findPeaks'):
+                    peaks = self.findPeaks()
+                self.__analysis = Analysis(corr, peaks, self.times[1] - self.times[0])
+            return self.__analysis
+
+    @property
+    def rpeaks(self):
+        with self.__lock:
+            if self.__rpeaks is None:
+                with self.stage('detectRPeaks'):
+                    self.__rpeaks = detectRPeaks(self.times, self.volt, thr=self.threshold)
+            return self.__rpeaks
 
     def read_csv(self):
 
@@ -154,106 +1068,353 @@ class Data:
             self.csvName + 'hello'
         except TypeError:
             print('Input file name must be a String type')
-            logging.warning('Input file entered was not a String type')
+            self.logger.warning('Input file entered was not a String type')
             raise TypeError('Input file entered was not a String type')
             return None
 
         try:
-            pd.read_csv(self.csvName)
+            with open(self.csvName, 'rb') as in_file:
+                content = in_file.read()
         except FileNotFoundError:
             print('No file with given filename found')
-            logging.debug('No file with given filename found')
+            self.logger.debug('No file with given filename found')
             raise FileNotFoundError('No file with given filename found')
-            return None
 
-        headers = ['Time', 'Voltage']
-        df = pd.read_csv(self.csvName, names=headers)
+        if self.reader != 'pandas':
+            # files with string or missing cells go straight to pandas instead of being parsed twice
+            samples = None
+            if plainNumeric(content):
+                try:
+                    # plain numeric files are parsed without importing pandas
+                    samples = np.loadtxt(io.BytesIO(content), delimiter=',', dtype=np.float64, ndmin=2)
+                except ValueError:
+                    # ragged rows, or letters of nan and inf in other words
+                    samples = None
+            if samples is not None and samples.shape[1] >= 2:
+                self.csvSamples = samples
+                return
+            if self.reader == 'numpy':
+                self.logger.warning('File is not a plain numeric csv file')
+                raise ValueError('File is not a plain numeric csv file with a time and voltage columns, use the '
+                                 'pandas reader')
+
+        # clean columns are parsed straight to float64, columns with string cells come back as object
+        df = requireModule('pandas').read_csv(io.BytesIO(content), header=None, engine='c')
+        if df.shape[1] < 2:
+            self.logger.warning('File has no voltage column')
+            raise ValueError('File must have a time column and at least one voltage column')
+        df.columns = ['Time', 'Voltage'] + ['Voltage%d' % (index + 2) for index in range(df.shape[1] - 2)]
         self.csvDf = df
 
     def extract_data(self):
 
         """ Method to extract the time and voltage data points from the csv file dataframe. Converts string values to
-        nan values, then interpolates data points. List is then normalized by subtracting the mean
-        :param: self - contains the csvDf attribute used to extract the volt and times data
+        nan values, then interpolates data points in place. Voltage is then normalized by subtracting the mean
+        Every column after the time column is a lead: the voltages become one 2D array with a row per lead, centered
+        in one pass over all leads
+        :param: self - contains the csvSamples or csvDf attribute used to extract the volt and times data
+        """
+        if self.csvSamples is not None:
+            times = np.ascontiguousarray(self.csvSamples[:, 0])
+            leads = np.ascontiguousarray(self.csvSamples[:, 1:].T)
+        else:
+            times = columnToFloat(self.csvDf.Time)
+            leads = np.empty((self.csvDf.shape[1] - 1, len(times)))
+            for index in range(len(leads)):
+                leads[index] = columnToFloat(self.csvDf.iloc[:, index + 1])
+        interpolateNaN(times)
+        interpolateLeads(leads)
+        leads -= leads.mean(axis=1, keepdims=True)
+        self.times = times
+        self.leads = leads
+        # times and leads are copies, do not keep the parsed table twice
+        self.csvSamples = None
+
+    def loadCache(self):
+
+        """ Method that sets times and volt from the binary cache instead of parsing the csv file
+        times and volt are then read-only views of a memory mapped file
+        :return: bool - True on a cache hit
         """
-        tempVolt = pd.to_numeric(self.csvDf.Voltage, errors='coerce')
-        tempTime = pd.to_numeric(self.csvDf.Time, errors='coerce')
+        if self.cache is None:
+            return False
+        samples = self.cache.load(self.csvName)
+        if samples is None:
+            return False
+        self.times = samples[0]
+        self.leads = samples[1:]
+        self.logger.info('voltage and time values have been loaded from cache')
+        return True
 
-        # if there are any string values, changes them to nan
+    def storeCache(self):
 
-        self.volt = pd.DataFrame(tempVolt).interpolate().values.ravel().tolist()
-        self.times = pd.DataFrame(tempTime).interpolate().values.ravel().tolist()
-        self.volt = self.volt - np.mean(self.volt)
+        """ Method that writes the extracted times and volt to the binary cache
+        """
+        if self.cache is None:
+            return
+        if self.cache.store(self.csvName, np.vstack([self.times[np.newaxis], self.leads])) is not None:
+            self.logger.info('voltage and time values have been cached')
 
     def correlate(self):
 
         """ Method that correlates two 1D arrays and generates a correlation matrix, starting from time lag 0
         :param: self - contains the voltage vectors used to correlate
         :return: corr - numpy array of the correlation constants, starting from time lag 0
-        :raises: ImportError - if math module from Python cannot be imported
         """
-        try:
-            import math
-        except ImportError:
-            print('Could not import math package')
-            logging.error('Could not import Python math package')
-
-        tempCorr = np.correlate(self.volt, self.volt, mode='same')
-        N = len(tempCorr)
-        tempCorr = tempCorr[math.floor(N / 2):]
-        lengths = range(N, math.floor(N / 2), -1)
-        tempCorr /= lengths
-        tempCorr /= tempCorr[0]
-        return tempCorr
+        return autocorrelate(self.volt, self.corrMethod)
+
+    def correlateLeads(self):
+
+        """ Method that correlates every lead in one batched call, see autocorrelate
+        :return: corr - 2D numpy array of the correlation constants, one row per lead, starting from time lag 0
+        """
+        return autocorrelate(self.leads, self.corrMethod)
 
     def modInterval(self):
 
-        """ Method that modulates the voltage interval based on user input
+        """ Method that modulates the voltage interval based on user input, keeping samples in
+        [intervalStart, interval). Uses binary search on times, which must be increasing, and keeps views of the
+        extracted arrays, so with a memory mapped cache entry the samples before intervalStart are never read
+        :raises: ValueError - if fewer than two samples fall in the interval
+        """
+        first, last = np.searchsorted(self.times, [self.intervalStart, self.interval], side='left')
+        if last - first < 2:
+            self.logger.warning('Fewer than two samples in the interval')
+            raise ValueError('Fewer than two samples between intervalStart %g and the end of the interval %g, the '
+                             'recording ends at %g' % (self.intervalStart, self.interval, self.times[-1]))
+        self.times = self.times[first:last]
+        self.leads = self.leads[:, first:last]
+
+    def preprocess(self):
+
+        """ Method that filters, decimates and resamples the trimmed signal with the options of this instance,
+        see preprocessLeads. The cached samples stay raw, so other options reuse the same cache entry
         """
-        index = 0
-        while self.times[index] < self.interval:
-            index += 1
+        times, leads, self.__decimation = preprocessLeads(self.times, self.leads, self.bandpass, self.targetRate,
+                                                          self.uniform)
+        self.times = times
+        self.leads = leads
 
-        self.times = self.times[0:index]
-        self.volt = self.volt[0:index]
+    def peakDistance(self, minDist=None):
+
+        """ Method that converts a minimum distance between peaks in samples of the recorded signal to samples of
+        the analyzed signal, dividing it by the decimation factor of preprocess
+        :param: minDist (int) - minimum distance in recorded samples - default to the minDist of this instance
+        :return: minDist (int) - minimum distance in analyzed samples, at least 1
+        """
+        if minDist is None:
+            minDist = self.minDist
+        return max(int(round(minDist / self.__decimation)), 1)
 
     def writeJSON(self):
 
         """ Method that writes all calculated attributes into JSON format
-        :writes: JSON files with all calculated attributes
-        :raises: ImportError - if json module cannot be loaded from Python
+        :writes: JSON files with all calculated attributes, see jsonPath
         """
-        try:
-            import json
-        except ImportError:
-            print('Could not import json module')
-            logging.error('Could not import Python module of json')
-
-        out_file = open(self.csvName[0:len(self.csvName)-4] + '.json', 'w')
-        dataDict = {'Mean HR (BPM)': self.mean_hr_bpm, 'Voltage Extremes': self.voltage_extremes,
-                    'Duration': self.duration, 'Number of Beats': self.num_beats, 'Beats': self.beats}
-        json.dump(dataDict, out_file)
+        dataDict = self.toDict()
+        with self.stage('writeJSON'):
+            if self.outputDir is not None:
+                os.makedirs(self.outputDir, exist_ok=True)
+            with open(self.jsonPath(), 'w') as out_file:
+                json.dump(dataDict, out_file)
         return True
 
+    def jsonPath(self):
+
+        """ Method that builds the path of the JSON file: the name of the csv file with a .json extension, in
+        outputDir or next to the csv file
+        :return: path (String)
+        """
+        fileName = os.path.splitext(os.path.basename(self.csvName))[0] + '.json'
+        outputDir = self.outputDir if self.outputDir is not None else os.path.dirname(self.csvName)
+        return os.path.join(outputDir, fileName)
+
+    def export(self, release=True):
+
+        """ Method that exports the results to a compact Result record, for keeping many results in memory
+        :param: release (bool) - also drop the parsed table, the samples and the cached analysis, so a retained
+                instance stops holding the recording; they are read again (from the binary cache when enabled) if
+                a metric is needed later - default to True
+        :return: result (Result)
+        """
+        result = Result(self.csvName, self.mean_hr_bpm, self.voltage_extremes, self.duration, self.num_beats,
+                        self.beats)
+        if release:
+            self.release()
+        return result
+
+    def release(self):
+
+        """ Method that drops the parsed table, the samples and every cached result, leaving the instance as a new
+        lazy one; instances built by fromSamples have no file to read again
+        """
+        with self.__lock:
+            self.csvDf = None
+            self.csvSamples = None
+            self.times = None
+            self.leads = None
+            self.__loaded = False
+            self.__duration = None
+            self.__interval = None
+            self.__voltage_extremes = None
+            self.__mean_hr_bpm = None
+            self.__num_beats = None
+            self.__beats = None
+
+    def toDict(self):
+
+        """ Method that collects all calculated attributes in the schema written by writeJSON
+        :return: dataDict (dict) - mean HR, voltage extremes, duration, number of beats and beats; for a multi-lead
+                file these describe the first lead, and 'Leads' (per lead mean HR, voltage extremes and number of
+                beats) and 'Consensus HR (BPM)' are added
+        """
+        dataDict = {'Mean HR (BPM)': float(self.mean_hr_bpm),
+                    'Voltage Extremes': [float(elem) for elem in self.voltage_extremes],
+                    'Duration': float(self.duration), 'Number of Beats': int(self.num_beats),
+                    'Beats': [float(elem) for elem in self.beats]}
+        if self.numLeads > 1:
+            # the fields above describe the first lead
+            dataDict['Leads'] = [{'Mean HR (BPM)': float(hr), 'Voltage Extremes': [float(low), float(high)],
+                                  'Number of Beats': int(count)}
+                                 for hr, (low, high), count in zip(self.lead_mean_hr_bpm, self.lead_voltage_extremes,
+                                                                   self.lead_num_beats)]
+            dataDict['Consensus HR (BPM)'] = float(self.consensus_hr_bpm)
+        return dataDict
+
     def findPeaks(self):
 
         """ Method that finds the maximum peak indices of the correlated voltage data
-        :param: self - contains the voltage vectors used to correlate
+        :param: self - contains the cached correlation, threshold and minDist used for peak detection
         :return: indices - array of the indices at which peaks occur
         :raises: ImportError - if peakutils cannot be imported from Python
         """
-        try:
-            import peakutils
-        except ImportError:
-            print('Could not import peakutils')
-            logging.error('Could not import peakutils')
+        peakutils = requireModule('peakutils')
 
-        self.minDist = int(self.minDist)
-        indices = peakutils.indexes(self.correlate(), thres=self.threshold, min_dist=self.minDist)
+        indices = peakutils.indexes(self.correlation, thres=self.threshold, min_dist=self.peakDistance())
         return indices
 
+    def windowedHR(self, window, hop, batchSize=64):
+
+        """ Method that computes the heart rate as a function of time over sliding windows of the trimmed data
+        Windows are strided views of volt, centered and autocorrelated batchSize at a time with one batched FFT,
+        then searched for peaks with the threshold and minDist of this instance. bpm comes from the mean spacing of
+        the autocorrelation peaks (one beat period), beat_count uses the same estimate as num_beats
+        :param: window (double) - window length in seconds
+        :param: hop (double) - time between the starts of consecutive windows in seconds
+        :param: batchSize (int) - number of windows correlated per FFT call - default to 64
+        :raises: ValueError - if window or hop are not positive, or window is longer than the data
+        :return: series - numpy array of WINDOW_DTYPE (window_start, bpm, beat_count), bpm is nan when fewer than
+                two peaks are found in a window
+        """
+        peakutils = requireModule('peakutils')
+
+        self.load()
+        stepSize = (self.times[-1] - self.times[0]) / (len(self.times) - 1)
+        windowSamples = int(round(window / stepSize))
+        hopSamples = int(round(hop / stepSize))
+        if windowSamples < 2 or hopSamples < 1:
+            raise ValueError('Window and hop must be positive and span at least one sample')
+        if windowSamples > len(self.volt):
+            raise ValueError('Window is longer than the data')
+
+        windows = np.lib.stride_tricks.sliding_window_view(self.volt, windowSamples)[::hopSamples]
+        series = np.zeros(len(windows), dtype=WINDOW_DTYPE)
+        series['window_start'] = self.times[:len(self.volt) - windowSamples + 1:hopSamples]
+        series['bpm'] = np.nan
+        for start in range(0, len(windows), batchSize):
+            batch = windows[start:start + batchSize]
+            batch = batch - batch.mean(axis=1, keepdims=True)
+            corr = correlateFFT(batch)
+            for index, row in enumerate(corr, start):
+                peaks = peakutils.indexes(row, thres=self.threshold, min_dist=self.peakDistance())
+                series['beat_count'][index] = len(peaks) * 2
+                if len(peaks) > 1:
+                    series['bpm'][index] = (len(peaks) - 1) * 60 / ((peaks[-1] - peaks[0]) * stepSize)
+        return series
+
+    def sweep(self, thresholds, minDists):
+
+        """ Method that evaluates the autocorrelation peak search over a grid of thresholds and minimum distances
+        The cached correlation is computed once. peakutils keeps a peak unless a higher kept peak lies within the
+        minimum distance, so peaks under the threshold never suppress higher ones: one search per minimum distance
+        with no threshold finds the kept peaks, and every threshold is then a vectorized mask over their heights.
+        A grid therefore costs one peak search per minimum distance instead of a full analysis per pair
+        :param: thresholds (array like) - normalized thresholds, each greater than 0
+        :param: minDists (array like) - minimum distances between peaks in recorded samples, see peakDistance, each
+                greater than 0
+        :raises: ValueError - if a threshold or minimum distance is not greater than 0
+        :return: grid - numpy array of SWEEP_DTYPE (thr, mD, mean_hr_bpm, num_beats) with one row per pair, thresholds
+                varying slowest; mean_hr_bpm and num_beats are those of Data(thr=thr, mD=mD), mean_hr_bpm is nan
+                when fewer than two peaks are found
+        """
+        peakutils = requireModule('peakutils')
+
+        thresholds = np.asarray(thresholds, dtype=np.float64).ravel()
+        minDists = np.asarray(minDists).astype(np.int64).ravel()
+        if np.any(thresholds <= 0):
+            raise ValueError('Threshold input must be greater than 0')
+        if np.any(minDists <= 0):
+            raise ValueError('Min distance between peaks must be greater than 0')
+
+        self.load()
+        corr = self.correlation
+        # same normalization as peakutils.indexes
+        levels = thresholds * (corr.max() - corr.min()) + corr.min()
+        grid = np.zeros((len(thresholds), len(minDists)), dtype=SWEEP_DTYPE)
+        grid['thr'] = thresholds[:, np.newaxis]
+        grid['mD'] = minDists[np.newaxis, :]
+        grid['mean_hr_bpm'] = np.nan
+        for column, minDist in enumerate(minDists):
+            peaks = peakutils.indexes(corr, thres=thresholds.min(), min_dist=self.peakDistance(minDist))
+            if not len(peaks):
+                # num_beats is already 0 and mean_hr_bpm nan
+                continue
+            above = corr[peaks][np.newaxis, :] > levels[:, np.newaxis]
+            counts = above.sum(axis=1)
+            found = counts > 1
+            first = peaks[np.argmax(above, axis=1)]
+            last = peaks[len(peaks) - 1 - np.argmax(above[:, ::-1], axis=1)]
+            span = self.times[last] - self.times[first]
+            grid['num_beats'][:, column] = counts * 2
+            grid['mean_hr_bpm'][found, column] = counts[found] * 60 / span[found]
+        return grid.ravel()
+
+    @property
+    def lead_mean_hr_bpm(self):
+        self.load()
+        rates = np.full(len(self.leads), np.nan)
+        for index, peaks in enumerate(self.leadPeaks):
+            if len(peaks) > 1:
+                span = self.times[peaks[-1]] - self.times[peaks[0]]
+                # same estimates as mean_hr_bpm
+                rates[index] = (len(peaks) - 1 if self.beatMethod == 'rpeak' else len(peaks)) * 60 / span
+        return rates
+
+    @property
+    def lead_voltage_extremes(self):
+        self.load()
+        return np.column_stack((self.leads.min(axis=1), self.leads.max(axis=1)))
+
+    @property
+    def lead_num_beats(self):
+        self.load()
+        factor = 1 if self.beatMethod == 'rpeak' else 2
+        return np.array([len(peaks) * factor for peaks in self.leadPeaks], dtype=np.int64)
+
+    @property
+    def consensus_hr_bpm(self):
+
+        """ Median of the lead heart rates, robust to one noisy or detached lead; nan if no lead has two beats
+        """
+        rates = self.lead_mean_hr_bpm
+        rates = rates[~np.isnan(rates)]
+        return float(np.median(rates)) if len(rates) else np.nan
+
     @property
     def mean_hr_bpm(self):
+        if self.__mean_hr_bpm is None:
+            self.load()
+            self.mean_hr_bpm = None
         return self.__mean_hr_bpm
 
     @mean_hr_bpm.setter
@@ -262,11 +1423,20 @@ class Data:
         """ Setter method for the mean_hr_bpm attribute
         :param mean_hr_bpm: Average heart rate beats per minute
         """
-        timeVals = [self.times[elem] for elem in self.findPeaks()]
+        if self.beatMethod == 'rpeak':
+            beatTimes = self.times[self.rpeaks]
+            # nan as for lead_mean_hr_bpm, a rate needs two beats
+            self.__mean_hr_bpm = (len(beatTimes) - 1) * 60 / (beatTimes[-1] - beatTimes[0]) if len(beatTimes) > 1 \
+                else np.nan
+            return
+        timeVals = [self.times[elem] for elem in self.analysis.peaks]
         self.__mean_hr_bpm = len(timeVals) * 60 / (timeVals[len(timeVals) - 1] - timeVals[0])
 
     @property
     def voltage_extremes(self):
+        if self.__voltage_extremes is None:
+            self.load()
+            self.voltage_extremes = None
         return self.__voltage_extremes
 
     @voltage_extremes.setter
@@ -279,6 +1449,8 @@ class Data:
 
     @property
     def duration(self):
+        if self.__duration is None:
+            self.load()
         return self.__duration
 
     @duration.setter
@@ -287,6 +1459,9 @@ class Data:
 
     @property
     def num_beats(self):
+        if self.__num_beats is None:
+            self.load()
+            self.num_beats = None
         return self.__num_beats
 
     @num_beats.setter
@@ -295,10 +1470,16 @@ class Data:
         """ Setter method for the num_beats attribute
         :param num_beats: int value of number of beats in given interval
         """
-        self.__num_beats = len(self.findPeaks())*2
+        if self.beatMethod == 'rpeak':
+            self.__num_beats = len(self.rpeaks)
+            return
+        self.__num_beats = len(self.analysis.peaks)*2
 
     @property
     def beats(self):
+        if self.__beats is None:
+            self.load()
+            self.beats = None
         return self.__beats
 
     @beats.setter
@@ -307,11 +1488,16 @@ class Data:
         """ Setter method for the beats attribute
         :param: beats: numpy array of all beats in given interval
         """
-        corrIndex = self.findPeaks()
-        stepSize = self.times[1] - self.times[0]
+        if self.beatMethod == 'rpeak':
+            self.__beats = self.times[self.rpeaks].tolist()
+            return
+        corrIndex = self.analysis.peaks
+        stepSize = self.analysis.stepSize
         peakDiff = corrIndex[1]-corrIndex[0]
         beatIndex = []
         for index in range(self.num_beats):
             beatIndex.append(index*peakDiff+corrIndex[0])
-        self.__beats = [elem * stepSize for elem in beatIndex]
+        # lags count from the first sample of the interval
+        start = self.times[0]
+        self.__beats = [start + elem * stepSize for elem in beatIndex]
 
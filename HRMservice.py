@@ -0,0 +1,277 @@
+try:
+    import asyncio
+    import json
+    import logging
+    import multiprocessing
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    print('Could not import Python standard library modules')
+
+from HRMbatch import initWorker
+from HRMcache import ResultCache
+from HRMdata import Data
+
+logger = logging.getLogger(__name__)
+
+# parameters a job may pass on to Data
+JOB_PARAMETERS = ('thr', 'mD', 'corrMethod', 'beatMethod', 'intervalStart', 'bandpass', 'targetRate', 'uniform')
+
+# largest accepted request body, uploaded samples included
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           422: 'Unprocessable Entity', 503: 'Service Unavailable'}
+
+class BadRequest(ValueError):
+
+    """ Raised by parseJob for a request body that is not a JSON object, answered with 400
+    """
+
+
+# results of path jobs, one cache per worker process, so files sent again are answered without a new analysis
+resultCache = ResultCache()
+
+
+def parseJob(body):
+
+    """ Parses the body of an analysis request
+    :param: body (bytes) - JSON encoded job
+    :raises: BadRequest - if the body is not a JSON object
+    :return: job (dict)
+    """
+    try:
+        job = json.loads(body.decode())
+    except ValueError:
+        raise BadRequest('Body must be a JSON object')
+    if not isinstance(job, dict):
+        raise BadRequest('Body must be a JSON object')
+    return job
+
+
+def runJob(job):
+
+    """ Runs one analysis job in an executor worker, without writing any file
+    :param: job (dict or bytes) - 'path' of a csv file or 'samples' ([[time, voltage], ...] or
+            {'times': [], 'volt': []}), 'userInterval' and optional Data parameters listed in JOB_PARAMETERS; a
+            request body is parsed here with parseJob, so large uploads neither block the event loop nor are pickled
+            as Python lists
+    :raises: BadRequest - if a request body is not a JSON object
+    :raises: ValueError - if the job has neither path nor samples
+    :return: dataDict (dict) - same schema as writeJSON
+    """
+    if isinstance(job, bytes):
+        job = parseJob(job)
+    kwargs = {key: job[key] for key in JOB_PARAMETERS if key in job}
+    userInterval = job.get('userInterval', float('inf'))
+    samples = job.get('samples')
+    if samples is None and 'path' in job:
+        return resultCache.analyze(job['path'], userInterval, **kwargs)
+    kwargs['logFile'] = None
+    if samples is not None:
+        if isinstance(samples, dict):
+            times, volt = samples.get('times', []), samples.get('volt', [])
+        else:
+            times, volt = [elem[0] for elem in samples], [elem[1] for elem in samples]
+        data = Data.fromSamples(times, volt, userInterval, **kwargs)
+    else:
+        raise ValueError('A job needs a path or samples')
+    return data.toDict()
+
+
+def ping():
+
+    """ Executor warm-up call, importing this module (and so HRMdata) in the worker
+    :return: pid (int) - process id of the worker
+    """
+    return os.getpid()
+
+
+class AnalysisService:
+
+    """ asyncio HTTP front end that runs Data analyses in a process pool
+    POST /analyze takes a JSON job (see runJob) and answers with the writeJSON schema; GET /health reports the queue.
+    Accepted jobs wait in a bounded queue served first in, first out by one task per worker, so a large file only
+    occupies one worker while the others keep serving. Bodies are queued as bytes and parsed by the worker, so a large
+    upload does not stall the event loop. When the queue is full, new jobs are refused at once with
+    503 and a Retry-After header, pushing back on clients instead of buffering without bound
+    :param: host (String) - TCP address to listen on - default to '127.0.0.1'
+    :param: port (int) - TCP port, 0 picks a free one - default to 8590
+    :param: unixPath (String) - listen on this Unix socket instead of TCP - default to None
+    :param: workers (int) - worker processes - default to os.cpu_count()
+    :param: queueSize (int) - jobs that may wait for a worker before new ones are refused - default to 4 * workers
+    :param: executor (Executor) - executor to run the jobs in, instead of a new process pool - default to None
+
+    :attribute: port (int) - port actually listened on, once started
+    :attribute: stats (dict) - accepted, rejected, completed and failed job counters
+    """
+    def __init__(self, host='127.0.0.1', port=8590, unixPath=None, workers=None, queueSize=None, executor=None):
+        self.host = host
+        self.port = port
+        self.unixPath = unixPath
+        self.workers = workers or os.cpu_count() or 1
+        self.queueSize = queueSize or 4 * self.workers
+        self.executor = executor
+        self.ownExecutor = executor is None
+        self.stats = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self.queue = None
+        self.server = None
+        self.tasks = []
+
+    async def start(self):
+
+        """ Method that starts the executor, the worker tasks and the listening socket
+        """
+        if self.executor is None:
+            # forked workers would inherit open client sockets and keep those connections from closing
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=initWorker, initargs=(None,),
+                                                mp_context=multiprocessing.get_context(method))
+            # start the workers before accepting jobs so the first clients do not wait for interpreter start up
+            loop = asyncio.get_event_loop()
+            await asyncio.gather(*[loop.run_in_executor(self.executor, ping) for index in range(self.workers)])
+        self.queue = asyncio.Queue(maxsize=self.queueSize)
+        self.tasks = [asyncio.ensure_future(self.work()) for index in range(self.workers)]
+        if self.unixPath is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=self.unixPath)
+        else:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        logger.info('Analysis service listening on %s' % (self.unixPath or '%s:%d' % (self.host, self.port)))
+
+    async def close(self):
+
+        """ Method that stops listening, cancels the worker tasks and shuts the executor down
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.ownExecutor and self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def serveForever(self):
+
+        """ Method that starts the service and serves until cancelled
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def work(self):
+
+        """ Worker task that hands queued jobs to the executor one at a time
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            job, future = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, runJob, job)
+            except Exception as err:
+                self.stats['failed'] += 1
+                if not future.done():
+                    future.set_exception(err)
+            else:
+                self.stats['completed'] += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    async def submit(self, job):
+
+        """ Method that queues a job and waits for its result
+        :param: job (dict or bytes) - see runJob
+        :raises: asyncio.QueueFull - if the queue is full
+        :return: dataDict (dict) - same schema as writeJSON
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((job, future))
+        self.stats['accepted'] += 1
+        return await future
+
+    async def handle(self, reader, writer):
+
+        """ Connection handler, one HTTP/1.1 request per connection
+        """
+        try:
+            status, body, headers = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, body, headers = 400, {'error': 'Malformed request'}, {}
+        payload = json.dumps(body).encode()
+        lines = ['HTTP/1.1 %d %s' % (status, REASONS.get(status, '')), 'Content-Type: application/json',
+                 'Content-Length: %d' % len(payload), 'Connection: close']
+        lines += ['%s: %s' % elem for elem in headers.items()]
+        try:
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+
+        """ Method that parses one request and computes its response
+        :return: status (int), body (dict), headers (dict)
+        """
+        requestLine = (await reader.readline()).decode('latin-1').split()
+        if len(requestLine) < 2:
+            raise ValueError('Malformed request line')
+        method, target = requestLine[0], requestLine[1]
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+
+        if target == '/health':
+            return 200, {'queued': self.queue.qsize(), 'queueSize': self.queueSize, 'workers': self.workers,
+                         'stats': self.stats}, {}
+        if target != '/analyze':
+            return 404, {'error': 'Unknown path'}, {}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}, {'Allow': 'POST'}
+        if length > MAX_BODY_BYTES:
+            return 413, {'error': 'Request body too large'}, {}
+        # the body is parsed by the worker, keeping the event loop free for other connections
+        body = await reader.readexactly(length)
+
+        try:
+            return 200, await self.submit(body), {}
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return 503, {'error': 'Queue full, retry later'}, {'Retry-After': '1'}
+        except BadRequest as err:
+            return 400, {'error': str(err)}, {}
+        except Exception as err:
+            return 422, {'error': '%s: %s' % (type(err).__name__, err)}, {}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve ECG analyses over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8590)
+    parser.add_argument('--unix', default=None, help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes')
+    parser.add_argument('--queue', type=int, default=None, help='jobs waiting for a worker before 503s')
+    args = parser.parse_args()
+
+    service = AnalysisService(args.host, args.port, args.unix, args.workers, args.queue)
+    try:
+        asyncio.run(service.serveForever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
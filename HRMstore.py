@@ -0,0 +1,216 @@
+try:
+    import numpy as np
+except ImportError:
+    print('Could not import numpy')
+
+try:
+    import logging
+    import os
+except ImportError:
+    print('Could not import Python standard library modules')
+
+logger = logging.getLogger(__name__)
+
+# first values of the header array of each block, to recognize a result store and its layout version
+STORE_MAGIC = 0x48524d52
+STORE_VERSION = 1
+
+# per-recording scalars of a result store, one row per recording
+RESULT_DTYPE = np.dtype([('mean_hr_bpm', np.float64), ('voltage_min', np.float64), ('voltage_max', np.float64),
+                         ('duration', np.float64), ('num_beats', np.int64)])
+
+
+class ResultWriter:
+
+    """ Buffered, append-only writer of analysis results for many recordings into one file
+    Results are buffered and written as blocks of consecutive .npy arrays: a header, the file names, the error
+    messages, the RESULT_DTYPE table of scalars, then the beats of all recordings of the block in a ragged layout,
+    one offsets array (beats of row i are values[offsets[i]:offsets[i + 1]]) and one values array. Opening an
+    existing store appends to it, so a store can grow over several batches. Use readResults to load it
+    :param: path (String) - store file, created if missing
+    :param: bufferSize (int) - recordings buffered before a block is written - default to 1024
+
+    :attribute: count (int) - recordings appended through this writer
+    """
+    def __init__(self, path, bufferSize=1024):
+        self.path = path
+        self.bufferSize = bufferSize
+        self.count = 0
+        self.__rows = []
+        self.__file = open(path, 'ab')
+
+    def append(self, fileName, result=None, error=None):
+
+        """ Method that buffers the result of one recording, writing a block once bufferSize are buffered
+        :param: fileName (String) - analyzed recording
+        :param: result (dict) - result in the writeJSON schema, None if the analysis failed - default to None
+        :param: error (String) - error message of a failed analysis - default to None
+        """
+        self.__rows.append((fileName, result, error))
+        self.count += 1
+        if len(self.__rows) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+
+        """ Method that writes the buffered results as one block
+        """
+        if not self.__rows:
+            return
+        rows = self.__rows
+        self.__rows = []
+        table = np.zeros(len(rows), dtype=RESULT_DTYPE)
+        table['mean_hr_bpm'] = np.nan
+        table['voltage_min'] = np.nan
+        table['voltage_max'] = np.nan
+        table['duration'] = np.nan
+        beats = []
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        for index, (fileName, result, error) in enumerate(rows):
+            if result is not None:
+                table[index] = (result['Mean HR (BPM)'], result['Voltage Extremes'][0],
+                                result['Voltage Extremes'][1], result['Duration'], result['Number of Beats'])
+                beats.extend(result['Beats'])
+            offsets[index + 1] = len(beats)
+
+        header = np.array([STORE_MAGIC, STORE_VERSION, len(rows)], dtype=np.int64)
+        for array in (header, np.array([elem[0] for elem in rows], dtype=str),
+                      np.array([elem[2] or '' for elem in rows], dtype=str), table, offsets,
+                      np.array(beats, dtype=np.float64)):
+            np.save(self.__file, array, allow_pickle=False)
+        self.__file.flush()
+        logger.info('Wrote %d results to %s' % (len(rows), self.path))
+
+    def close(self):
+
+        """ Method that writes the remaining buffered results and closes the file
+        """
+        if self.__file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+class ResultTable:
+
+    """ Results of many recordings in columnar form, as read by readResults
+    :attribute: files (numpy array) - recording names
+    :attribute: errors (numpy array) - error messages, empty strings for successful analyses
+    :attribute: table (numpy array) - RESULT_DTYPE scalars, nan for failed analyses
+    :attribute: offsets (numpy array) - beats of row i are values[offsets[i]:offsets[i + 1]]
+    :attribute: values (numpy array) - beat times of all recordings, concatenated
+    """
+    def __init__(self, files, errors, table, offsets, values):
+        self.files = files
+        self.errors = errors
+        self.table = table
+        self.offsets = offsets
+        self.values = values
+
+    @classmethod
+    def fromResults(cls, results):
+
+        """ Builds a table from Result records, as exported by Data.export, for cohort statistics over many
+        recordings in a few arrays
+        :param: results (iterable) - HRMdata.Result records
+        :return: results (ResultTable)
+        """
+        results = list(results)
+        table = np.zeros(len(results), dtype=RESULT_DTYPE)
+        for name in RESULT_DTYPE.names:
+            table[name] = [getattr(elem, name) for elem in results]
+        offsets = np.zeros(len(results) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(elem.beats) for elem in results])
+        values = np.concatenate([np.frombuffer(elem.beats, dtype=np.float64) for elem in results] + [np.zeros(0)])
+        return cls(np.array([elem.file for elem in results], dtype=str), np.full(len(results), '', dtype='<U1'),
+                   table, offsets, values)
+
+    def __len__(self):
+        return len(self.table)
+
+    def beats(self, index):
+
+        """ Method that returns the beat times of one recording, as a view of values
+        :param: index (int) - row of the recording
+        :return: beats - numpy array
+        """
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def toDict(self, index):
+
+        """ Method that rebuilds the writeJSON schema of one recording
+        :param: index (int) - row of the recording
+        :return: dataDict (dict) - result, or None if its analysis failed
+        """
+        if self.errors[index]:
+            return None
+        row = self.table[index]
+        return {'Mean HR (BPM)': float(row['mean_hr_bpm']),
+                'Voltage Extremes': [float(row['voltage_min']), float(row['voltage_max'])],
+                'Duration': float(row['duration']), 'Number of Beats': int(row['num_beats']),
+                'Beats': self.beats(index).tolist()}
+
+    def savez(self, path):
+
+        """ Method that writes the table as one compressed .npz file, which readResults also reads
+        :param: path (String) - .npz file
+        """
+        np.savez_compressed(path, files=self.files, errors=self.errors, table=self.table, offsets=self.offsets,
+                            values=self.values)
+
+
+def readResults(path):
+
+    """ Reads a store written by ResultWriter, or a .npz file written by ResultTable.savez
+    Blocks are concatenated and their beat offsets shifted, with one numpy read per array. A block cut short, as
+    by a writer that was killed, ends the read with a warning
+    :param: path (String) - store or .npz file
+    :raises: FileNotFoundError - if the file cannot be found
+    :raises: ValueError - if the file is not a result store
+    :return: results (ResultTable)
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError('No file with given filename found')
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle=False) as arrays:
+            return ResultTable(arrays['files'], arrays['errors'], arrays['table'], arrays['offsets'],
+                               arrays['values'])
+
+    blocks = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as in_file:
+        while in_file.tell() < size:
+            start = in_file.tell()
+            try:
+                header = np.load(in_file, allow_pickle=False)
+                if len(header) != 3 or header[0] != STORE_MAGIC:
+                    raise ValueError('Not a result store: ' + path)
+                if header[1] != STORE_VERSION:
+                    raise ValueError('Unsupported result store version %d' % header[1])
+                blocks.append([np.load(in_file, allow_pickle=False) for index in range(5)])
+            except (EOFError, OSError) as err:
+                logger.warning('Incomplete block at byte %d of %s: %s' % (start, path, err))
+                break
+            except ValueError:
+                if not blocks and start == 0:
+                    raise
+                logger.warning('Incomplete block at byte %d of %s' % (start, path))
+                break
+
+    if not blocks:
+        return ResultTable(np.array([], dtype=str), np.array([], dtype=str), np.zeros(0, dtype=RESULT_DTYPE),
+                           np.zeros(1, dtype=np.int64), np.zeros(0))
+    shifts = np.cumsum([0] + [len(elem[4]) for elem in blocks[:-1]])
+    offsets = np.concatenate([[0]] + [elem[3][1:] + shift for elem, shift in zip(blocks, shifts)])
+    return ResultTable(np.concatenate([elem[0] for elem in blocks]), np.concatenate([elem[1] for elem in blocks]),
+                       np.concatenate([elem[2] for elem in blocks]), offsets.astype(np.int64),
+                       np.concatenate([elem[4] for elem in blocks]))
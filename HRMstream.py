@@ -0,0 +1,204 @@
+try:
+    import numpy as np
+except ImportError:
+    print('Could not import numpy')
+
+try:
+    import os
+    import time
+    from collections import namedtuple
+except ImportError:
+    print('Could not import Python standard library modules')
+
+from HRMdata import interpolateNaN, requireModule
+
+# state reported after each chunk: rolling mean HR over the buffer, beats seen so far and the beat times new
+# in this chunk
+StreamUpdate = namedtuple('StreamUpdate', ['mean_hr_bpm', 'num_beats', 'new_beats'])
+
+
+class StreamAnalyzer:
+
+    """ Incremental heart rate analysis over chunks of (time, voltage) samples
+    The latest samples are kept in a ring buffer of fixed capacity, so the cost of each chunk depends on the capacity
+    and not on how long the stream has been running. Beats are the peaks of the buffered, centered voltage, found
+    with the same threshold and minimum distance semantics as Data.findPeaks, so mD should be close to the shortest
+    expected RR interval in samples. A beat is reported once mD samples have followed it, since a later, higher
+    peak could still replace it before then
+    :param: capacity (int) - number of samples kept in the ring buffer - default to 4096
+    :param: thr (double) - threshold for peak detection - default to 0.18
+    :param: mD (int) - minimum distance between peaks in samples - default to 200
+    :raises: ValueError - if thr or mD are not positive or capacity is not larger than 2 * mD
+
+    :attribute: mean_hr_bpm (double) - average heart rate over the beats in the buffer, None until two are found
+    :attribute: num_beats (int) - number of beats reported since the start of the stream
+    :attribute: lastBeat (double) - time of the last reported beat
+    """
+    def __init__(self, capacity=4096, thr=0.18, mD=200):
+        if thr <= 0:
+            raise ValueError('Threshold input must be greater than 0')
+        if mD <= 0:
+            raise ValueError('Min distance between peaks must be greater than 0')
+        if capacity <= 2 * mD:
+            raise ValueError('Buffer capacity must be larger than twice the min distance between peaks')
+        self.capacity = int(capacity)
+        self.threshold = thr
+        self.minDist = int(mD)
+        self.__times = np.zeros(self.capacity)
+        self.__volt = np.zeros(self.capacity)
+        self.__head = 0
+        self.size = 0
+        self.mean_hr_bpm = None
+        self.num_beats = 0
+        self.lastBeat = -np.inf
+
+    def window(self):
+
+        """ Method that returns the buffered samples in time order
+        :return: times, volt - numpy arrays of at most capacity samples
+        """
+        start = (self.__head - self.size) % self.capacity
+        if start + self.size <= self.capacity:
+            return self.__times[start:start + self.size], self.__volt[start:start + self.size]
+        return (np.concatenate((self.__times[start:], self.__times[:self.__head])),
+                np.concatenate((self.__volt[start:], self.__volt[:self.__head])))
+
+    def push(self, times, volt):
+
+        """ Method that appends a chunk of samples to the buffer and updates the analysis
+        nan samples (e.g. from unparseable cells) are interpolated within the chunk
+        :param: times (array like) - sample times, increasing
+        :param: volt (array like) - sample voltages, same length as times
+        :raises: ValueError - if times and volt differ in length
+        :return: StreamUpdate
+        """
+        times = np.array(times, dtype=np.float64).ravel()
+        volt = np.array(volt, dtype=np.float64).ravel()
+        if len(times) != len(volt):
+            raise ValueError('times and volt must have the same length')
+        interpolateNaN(times)
+        interpolateNaN(volt)
+        times = times[-self.capacity:]
+        volt = volt[-self.capacity:]
+
+        first = min(len(times), self.capacity - self.__head)
+        self.__times[self.__head:self.__head + first] = times[:first]
+        self.__volt[self.__head:self.__head + first] = volt[:first]
+        self.__times[:len(times) - first] = times[first:]
+        self.__volt[:len(volt) - first] = volt[first:]
+        self.__head = (self.__head + len(times)) % self.capacity
+        self.size = min(self.size + len(times), self.capacity)
+        return self.update()
+
+    def update(self):
+
+        """ Method that recomputes the rolling heart rate and reports the beats confirmed since the last update
+        :return: StreamUpdate
+        """
+        peakutils = requireModule('peakutils')
+        if self.size <= 2 * self.minDist:
+            return StreamUpdate(self.mean_hr_bpm, self.num_beats, np.empty(0))
+        times, volt = self.window()
+        centered = volt - volt.mean()
+
+        beats = peakutils.indexes(centered, thres=self.threshold, min_dist=self.minDist)
+        beats = beats[beats < self.size - self.minDist]
+        if len(beats) > 1:
+            self.mean_hr_bpm = (len(beats) - 1) * 60 / (times[beats[-1]] - times[beats[0]])
+        # a beat found again after the window moved may land on a neighbouring sample of the same plateau
+        stepSize = (times[-1] - times[0]) / (self.size - 1)
+        newBeats = times[beats][times[beats] > self.lastBeat + self.minDist * stepSize]
+        if len(newBeats):
+            self.lastBeat = newBeats[-1]
+            self.num_beats += len(newBeats)
+        return StreamUpdate(self.mean_hr_bpm, self.num_beats, newBeats)
+
+    def run(self, chunks):
+
+        """ Generator that feeds chunks to the analyzer and yields an update per chunk
+        :param: chunks (iterable) - (times, volt) pairs, or 2D arrays with times in column 0 and voltages in column 1
+        :return: generator of StreamUpdate
+        """
+        for chunk in chunks:
+            if isinstance(chunk, tuple):
+                times, volt = chunk
+            else:
+                chunk = np.asarray(chunk, dtype=np.float64)
+                times, volt = chunk[:, 0], chunk[:, 1]
+            yield self.push(times, volt)
+
+
+def parseLines(lines):
+
+    """ Parses 'time,voltage' text lines, unparseable cells become nan
+    :param: lines (list) - lines of a two column csv file
+    :return: samples - 2D float64 array, times in column 0 and voltages in column 1
+    """
+    samples = np.full((len(lines), 2), np.nan)
+    for index, line in enumerate(lines):
+        cells = line.strip().split(',')
+        for column in range(min(len(cells), 2)):
+            try:
+                samples[index, column] = float(cells[column])
+            except ValueError:
+                pass
+    return samples
+
+
+def tailChunks(fileName, chunkSize=500, poll=0.5, follow=True):
+
+    """ Generator that reads a csv file being written, in chunks of complete lines
+    :param: fileName (String) - csv file to tail
+    :param: chunkSize (int) - maximum number of samples per chunk - default to 500
+    :param: poll (double) - seconds to wait for new data at the end of the file - default to 0.5
+    :param: follow (bool) - keep waiting for new data at the end of the file, otherwise stop - default to True
+    :return: generator of 2D float64 arrays, times in column 0 and voltages in column 1
+    """
+    with open(fileName, 'r') as in_file:
+        pending = ''
+        lines = []
+        while True:
+            text = in_file.readline()
+            if text:
+                pending += text
+                if not pending.endswith('\n'):
+                    # partial line, the writer has not finished it yet
+                    continue
+                if pending.strip():
+                    lines.append(pending)
+                pending = ''
+                if len(lines) >= chunkSize:
+                    yield parseLines(lines)
+                    lines = []
+                continue
+            if lines:
+                yield parseLines(lines)
+                lines = []
+            if not follow:
+                if pending.strip():
+                    yield parseLines([pending])
+                return
+            time.sleep(poll)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Stream heart rate from a csv file being written')
+    parser.add_argument('file', help='csv file to tail')
+    parser.add_argument('--capacity', type=int, default=4096, help='samples kept in the ring buffer')
+    parser.add_argument('--thr', type=float, default=0.18, help='threshold for peak detection')
+    parser.add_argument('--mD', type=int, default=200, help='minimum distance between peaks')
+    parser.add_argument('--chunk', type=int, default=500, help='samples per chunk')
+    parser.add_argument('--no-follow', action='store_true', help='stop at the end of the file')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise FileNotFoundError('No file with given filename found')
+    analyzer = StreamAnalyzer(capacity=args.capacity, thr=args.thr, mD=args.mD)
+    for update in analyzer.run(tailChunks(args.file, args.chunk, follow=not args.no_follow)):
+        for beat in update.new_beats:
+            print('beat at %.3f s, %d beats, mean HR %s BPM' % (beat, update.num_beats, update.mean_hr_bpm))
+
+
+if __name__ == '__main__':
+    main()
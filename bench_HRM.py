@@ -0,0 +1,414 @@
+""" Benchmarks for the HRMdata module
+
+Run from the repository root:
+    python bench_HRM.py correlate    - direct vs FFT autocorrelation crossover on the bundled test_data*.csv files
+    python bench_HRM.py service      - load test of the HRMservice analysis service
+    python bench_HRM.py stages       - per stage timings of Data on the normal, abnormal and upsampled recordings,
+                                       saved as JSON; --compare old.json reports the change against a previous run
+    python bench_HRM.py import       - start up cost of fresh processes importing HRMdata and analyzing a small file
+    python bench_HRM.py memory       - memory per retained result: Data instances, Result records and a ResultTable
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import HRMdata
+
+
+def bestOf(func, repeat=5):
+
+    """ Returns the best wall clock time in seconds of func over several runs
+    :param: func (callable) - zero argument function to time
+    :param: repeat (int) - number of timed runs
+    """
+    number = 1
+    # grow the loop count until one measurement takes at least 20 ms
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed > 0.02 or number >= 1000:
+            break
+        number *= 10
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def benchCorrelate(args):
+
+    """ Times correlateDirect against correlateFFT on prefixes of every bundled recording and
+    reports the length at which the FFT method starts to win
+    """
+    files = sorted(glob.glob(args.files))
+    sizes = [2 ** p for p in range(5, 14)]
+    print('%-18s %8s %12s %12s %8s' % ('file', 'samples', 'direct (ms)', 'fft (ms)', 'speedup'))
+    crossovers = []
+    for fileName in files:
+        volt = np.genfromtxt(fileName, delimiter=',')[:, 1]
+        volt = volt[~np.isnan(volt)]
+        volt = volt - volt.mean()
+        crossover = None
+        for size in sizes + [len(volt)]:
+            if size > len(volt):
+                continue
+            segment = volt[:size]
+            tDirect = bestOf(lambda: HRMdata.correlateDirect(segment.copy()), args.repeat)
+            tFFT = bestOf(lambda: HRMdata.correlateFFT(segment), args.repeat)
+            if crossover is None and tFFT < tDirect:
+                crossover = size
+            print('%-18s %8d %12.3f %12.3f %7.1fx' % (fileName, size, tDirect * 1e3, tFFT * 1e3, tDirect / tFFT))
+        crossovers.append(crossover)
+    found = [elem for elem in crossovers if elem is not None]
+    if found:
+        print('FFT faster from a median of %d samples (CORR_FFT_CUTOFF = %d)'
+              % (int(np.median(found)), HRMdata.CORR_FFT_CUTOFF))
+
+
+# recordings with abnormal content (string cells, missing values, irregular signal), benchmarked as their own group
+ABNORMAL_FILES = (28, 30, 31, 32)
+
+STAGES = ('read_csv', 'extract_data', 'modInterval', 'correlate', 'findPeaks', 'writeJSON')
+
+
+def fileNumber(fileName):
+    return int(re.search(r'(\d+)\.csv$', fileName).group(1))
+
+
+def upsample(fileName, factor, outDir):
+
+    """ Writes a long synthetic recording by linear interpolation of a bundled one on a factor times finer grid
+    :return: path (String) - the written csv file
+    """
+    samples = np.genfromtxt(fileName, delimiter=',')
+    samples = samples[~np.isnan(samples).any(axis=1)]
+    times = np.linspace(samples[0, 0], samples[-1, 0], (len(samples) - 1) * factor + 1)
+    volt = np.interp(times, samples[:, 0], samples[:, 1])
+    path = os.path.join(outDir, 'upsampled%dx_%s' % (factor, os.path.basename(fileName)))
+    np.savetxt(path, np.column_stack((times, volt)), delimiter=',', fmt='%.6f')
+    return path
+
+
+def peakRSS():
+
+    """ Returns the peak resident set size of this process in MB
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage / 1024 ** 2 if platform.system() == 'Darwin' else usage / 1024
+
+
+def timeStages(fileName, repeat):
+
+    """ Times each stage of Data separately, keeping the best of repeat runs of each
+    Every stage runs on the output of the previous ones, as in Data.load and the constructor
+    :return: seconds (dict) - best time of each stage, samples (int) - samples in the file
+    """
+    data = HRMdata.Data(fileName, float('inf'), lazy=True, cache=False, logFile=None)
+
+    def best(stage, setup=None):
+        times = []
+        for run in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            stage()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def trimSetup():
+        data.read_csv()
+        data.extract_data()
+        data.duration = None
+        data.interval = None
+
+    seconds = {'read_csv': best(data.read_csv)}
+    # extract_data releases the parsed table, so each run parses the file again untimed
+    seconds['extract_data'] = best(data.extract_data, data.read_csv)
+    samples = len(data.times)
+    seconds['modInterval'] = best(data.modInterval, trimSetup)
+    seconds['correlate'] = best(data.correlate)
+    seconds['findPeaks'] = best(data.findPeaks)
+    seconds['writeJSON'] = best(data.writeJSON)
+    return seconds, samples
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchStages(args):
+
+    """ Times the stages of Data on every bundled recording and on upsampled long versions of the first one, then
+    writes the timings, throughputs and peak RSS to a JSON file
+    Files are copied to a temporary directory so writeJSON does not touch the repository. Groups are run from the
+    smallest files up, since the peak RSS of a process only grows
+    """
+    files = sorted(glob.glob(args.files), key=fileNumber)
+    if not files:
+        raise SystemExit('No recordings match ' + args.files)
+    workDir = tempfile.mkdtemp(prefix='hrmbench')
+    try:
+        groups = [('normal', [elem for elem in files if fileNumber(elem) not in ABNORMAL_FILES]),
+                  ('abnormal', [elem for elem in files if fileNumber(elem) in ABNORMAL_FILES])]
+        groups = [(group, [shutil.copy(elem, workDir) for elem in groupFiles]) for group, groupFiles in groups]
+        for factor in args.upsample:
+            groups.append(('upsampled', [upsample(groups[0][1][0], factor, workDir)]))
+
+        results = []
+        print('%-10s %-28s %9s %s %10s %8s' % ('group', 'file', 'samples', ' '.join('%12s' % elem for elem in STAGES),
+                                             'Msamples/s', 'RSS MB'))
+        for group, groupFiles in groups:
+            for fileName in groupFiles:
+                seconds, samples = timeStages(fileName, args.repeat)
+                total = sum(seconds.values())
+                row = {'group': group, 'file': os.path.basename(fileName), 'samples': samples,
+                       'seconds': seconds, 'samplesPerSecond': {key: samples / value if value else None
+                                                                for key, value in seconds.items()},
+                       'totalSamplesPerSecond': samples / total, 'peakRSSMB': peakRSS()}
+                results.append(row)
+                print('%-10s %-28s %9d %s %10.2f %8.1f'
+                      % (group, row['file'], samples, ' '.join('%9.3f ms' % (seconds[elem] * 1e3) for elem in STAGES),
+                         row['totalSamplesPerSecond'] / 1e6, row['peakRSSMB']))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    report = {'commit': gitCommit(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'machine': platform.machine(), 'repeat': args.repeat, 'results': results}
+    with open(args.output, 'w') as out_file:
+        json.dump(report, out_file, indent=1)
+    print('Results written to ' + args.output)
+    if args.compare:
+        compareStages(args.compare, report)
+
+
+def compareStages(baseName, report):
+
+    """ Prints the change in time of each stage against a previous stages report, as the geometric mean over the
+    files of each group found in both reports
+    """
+    with open(baseName, 'r') as in_file:
+        base = json.load(in_file)
+    old = {(row['group'], row['file']): row['seconds'] for row in base['results']}
+    ratios = {}
+    for row in report['results']:
+        previous = old.get((row['group'], row['file']))
+        if previous is None:
+            continue
+        for stage, seconds in row['seconds'].items():
+            if previous.get(stage):
+                ratios.setdefault((row['group'], stage), []).append(seconds / previous[stage])
+    print('Change against %s (commit %s), positive is slower' % (baseName, base.get('commit')))
+    for key in sorted(ratios):
+        print('%-10s %-14s %+7.1f%%' % (key[0], key[1], (np.exp(np.mean(np.log(ratios[key]))) - 1) * 100))
+
+
+IMPORT_CASES = (
+    ('interpreter only', 'pass'),
+    ('import HRMdata', 'import HRMdata'),
+    ('import HRMdata with pandas', 'import pandas, HRMdata'),
+    ('rpeak analysis, numpy reader', 'from HRMdata import Data; '
+     'Data({file!r}, 10000, lazy=True, cache=False, logFile=None, beatMethod="rpeak").toDict()'),
+    ('rpeak analysis, pandas reader', 'from HRMdata import Data; '
+     'Data({file!r}, 10000, lazy=True, cache=False, logFile=None, beatMethod="rpeak", reader="pandas").toDict()'),
+    ('autocorr analysis, numpy reader', 'from HRMdata import Data; '
+     'Data({file!r}, 10000, lazy=True, cache=False, logFile=None).toDict()'),
+    ('autocorr analysis, pandas reader', 'from HRMdata import Data; '
+     'Data({file!r}, 10000, lazy=True, cache=False, logFile=None, reader="pandas").toDict()'),
+)
+
+
+def benchImport(args):
+
+    """ Times fresh interpreter processes that import HRMdata, with and without pandas loaded up front, and that
+    analyze one small file with each reader, as a short-lived CLI or worker process does
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    print('%-34s %10s %10s' % ('case', 'best (ms)', 'median (ms)'))
+    for name, code in IMPORT_CASES:
+        command = [sys.executable, '-c', code.format(file=args.file)]
+        times = []
+        for run in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.check_call(command, cwd=root)
+            times.append(time.perf_counter() - start)
+        print('%-34s %10.1f %10.1f' % (name, min(times) * 1e3, np.median(times) * 1e3))
+
+
+def retainedBytes(build, count):
+
+    """ Returns the bytes traced by tracemalloc per result while the output of build(count) is kept alive
+    :param: build (callable) - called with count, returns the retained object(s)
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build(count)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def benchMemory(args):
+
+    """ Measures the memory held per retained result when keeping analyzed recordings alive as Data instances,
+    as Data instances after export(), as Result records and as one ResultTable
+    """
+    from array import array
+    import HRMstore
+    files = [elem for elem in sorted(glob.glob(args.files), key=fileNumber) if fileNumber(elem) not in ABNORMAL_FILES]
+    exported = [HRMdata.Data(elem, float('inf'), lazy=True, cache=False, logFile=None).export() for elem in files]
+
+    def analyzed(index, release):
+        data = HRMdata.Data(files[index % len(files)], float('inf'), lazy=True, cache=False, logFile=None)
+        data.toDict()
+        if release:
+            data.export()
+        return data
+
+    def record(index):
+        # a distinct copy of every field, as results of distinct recordings would be
+        elem = exported[index % len(exported)]
+        return HRMdata.Result('%s#%d' % (elem.file, index), elem.mean_hr_bpm, elem.voltage_extremes,
+                              elem.duration, elem.num_beats, array('d', elem.beats))
+
+    cases = [('Data, analyzed', args.data, lambda count: [analyzed(index, False) for index in range(count)]),
+             ('Data after export()', args.data, lambda count: [analyzed(index, True) for index in range(count)]),
+             ('Result', args.count, lambda count: [record(index) for index in range(count)]),
+             ('ResultTable', args.count,
+              lambda count: HRMstore.ResultTable.fromResults(record(index) for index in range(count)))]
+    print('%-22s %8s %14s' % ('retained as', 'count', 'bytes/result'))
+    for name, count, build in cases:
+        print('%-22s %8d %14.0f' % (name, count, retainedBytes(build, count)))
+
+
+async def postJSON(host, port, path, body):
+
+    """ Minimal HTTP/1.1 client used by the service load test
+    :return: status (int), body (dict)
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body).encode()
+    writer.write(('POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                  % (path, host, len(payload))).encode() + payload)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(content.decode())
+
+
+async def loadTest(args):
+
+    """ Fires args.requests jobs from args.clients concurrent clients, each client sending its next job as soon as
+    the previous one is answered, and retrying after a 503 like a well-behaved client
+    """
+    import HRMservice
+    service = None
+    host, port = args.host, args.port
+    if port is None:
+        service = HRMservice.AnalysisService(port=0, workers=args.workers, queueSize=args.queue)
+        await service.start()
+        host, port = service.host, service.port
+
+    files = sorted(glob.glob(args.files))
+    jobs = [{'path': files[index % len(files)], 'userInterval': 10000} for index in range(args.requests)]
+    latencies = []
+    rejected = [0]
+    errors = [0]
+
+    async def client(clientJobs):
+        for job in clientJobs:
+            start = time.perf_counter()
+            while True:
+                status, body = await postJSON(host, port, '/analyze', job)
+                if status != 503:
+                    break
+                rejected[0] += 1
+                await asyncio.sleep(0.05)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(jobs[index::args.clients]) for index in range(args.clients)])
+    elapsed = time.perf_counter() - start
+    if service is not None:
+        await service.close()
+
+    latencies = np.array(latencies) * 1e3
+    print('%d requests from %d clients in %.2f s: %.1f requests/s' % (len(jobs), args.clients, elapsed,
+                                                                     len(jobs) / elapsed))
+    print('latency ms: p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % tuple(np.percentile(latencies, [50, 90, 99, 100])))
+    print('503 responses retried: %d, failed requests: %d' % (rejected[0], errors[0]))
+
+
+def benchService(args):
+
+    """ Load test of the analysis service, started in this process unless --port points at a running one
+    """
+    asyncio.run(loadTest(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    corr = sub.add_parser('correlate', help='direct vs FFT autocorrelation crossover')
+    corr.add_argument('--files', default='test_data*.csv', help='glob of recordings to benchmark')
+    corr.add_argument('--repeat', type=int, default=5)
+    corr.set_defaults(func=benchCorrelate)
+
+    service = sub.add_parser('service', help='load test of the HRMservice analysis service')
+    service.add_argument('--files', default='test_data*.csv', help='glob of recordings to submit')
+    service.add_argument('--requests', type=int, default=200, help='total number of requests')
+    service.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    service.add_argument('--host', default='127.0.0.1')
+    service.add_argument('--port', type=int, default=None, help='port of a running service, else one is started')
+    service.add_argument('--workers', type=int, default=None, help='workers of the started service')
+    service.add_argument('--queue', type=int, default=None, help='queue size of the started service')
+    service.set_defaults(func=benchService)
+
+    stages = sub.add_parser('stages', help='per stage timings of Data, saved as JSON')
+    stages.add_argument('--files', default='test_data*.csv', help='glob of bundled recordings')
+    stages.add_argument('--upsample', type=int, nargs='*', default=[10, 100],
+                        help='factors of the upsampled long recordings')
+    stages.add_argument('--repeat', type=int, default=3)
+    stages.add_argument('--output', default='bench_stages.json', help='JSON report to write')
+    stages.add_argument('--compare', default=None, help='previous JSON report to compare against')
+    stages.set_defaults(func=benchStages)
+
+    imports = sub.add_parser('import', help='start up cost of fresh processes using HRMdata')
+    imports.add_argument('--file', default='test_data1.csv', help='small recording analyzed by the analysis cases')
+    imports.add_argument('--repeat', type=int, default=10)
+    imports.set_defaults(func=benchImport)
+
+    memory = sub.add_parser('memory', help='memory per retained result')
+    memory.add_argument('--files', default='test_data*.csv', help='glob of bundled recordings')
+    memory.add_argument('--data', type=int, default=200, help='Data instances retained')
+    memory.add_argument('--count', type=int, default=20000, help='Result records retained')
+    memory.set_defaults(func=benchMemory)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
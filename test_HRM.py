@@ -87,6 +87,655 @@ def test_json():
     assert jsonTest.writeJSON() == True
 
 
+def test_correlate():
 
+    """ tests that the FFT autocorrelation matches the direct np.correlate method, for odd and even lengths
+    and on a full recording
+    """
+    import numpy as np
+    from HRMdata import Data, correlateDirect, correlateFFT
+    for N in [1, 2, 5, 64, 1001]:
+        volt = np.sin(np.arange(N) * 0.3) + np.cos(np.arange(N) * 0.07)
+        assert np.allclose(correlateFFT(volt), correlateDirect(volt.copy()))
+
+    direct = Data(dataStr='test_data1.csv', userInterval=10000, corrMethod='direct')
+    fft = Data(dataStr='test_data1.csv', userInterval=10000, corrMethod='fft')
+    assert np.allclose(direct.correlate(), fft.correlate())
+    assert direct.num_beats == fft.num_beats
+
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data1.csv', userInterval=10000, corrMethod='hello')
+
+
+def test_analysisCache():
+
+    """ tests that the correlation and peak search run once per instance, and that changing threshold only
+    redoes the peak search while changing volt redoes both
+    """
+    from HRMdata import Data
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000)
+    analysis = testObj.analysis
+    assert testObj.analysis is analysis
+    assert testObj.num_beats == len(analysis.peaks) * 2
+
+    testObj.threshold = 0.5
+    assert testObj.analysis is not analysis
+    assert testObj.analysis.corr is analysis.corr
+
+    testObj.volt = testObj.volt * 2
+    assert testObj.analysis.corr is not analysis.corr
+
+
+def test_derivedReset():
+
+    """ tests that mean_hr_bpm, num_beats, beats and voltage_extremes are recomputed after threshold, minDist or
+    volt change
+    """
+    from HRMdata import Data
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False)
+    assert testObj.num_beats == 32
+    testObj.threshold = 0.9
+    assert testObj.num_beats == len(testObj.analysis.peaks) * 2 != 32
+
+    testObj.threshold = 0.18
+    beats = testObj.beats
+    testObj.minDist = 400
+    assert testObj.num_beats == len(testObj.analysis.peaks) * 2
+    assert testObj.beats != beats
+
+    low, high = testObj.voltage_extremes
+    testObj.volt = testObj.volt * 2
+    assert testObj.voltage_extremes == (2 * low, 2 * high)
+
+
+def test_lazy():
+
+    """ tests that lazy mode defers parsing until first use, and that cheap queries do not run the autocorrelation
+    """
+    from HRMdata import Data
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True)
+    assert testObj.times is None
+
+    # any call to the autocorrelation would now raise a TypeError
+    testObj.correlate = None
+    assert testObj.duration == 27.775
+    assert testObj.voltage_extremes[0] < 0 < testObj.voltage_extremes[1]
+
+    del testObj.correlate
+    assert testObj.mean_hr_bpm >= 78.35-5 and testObj.mean_hr_bpm <= 78.35+5
+    assert testObj.num_beats >= 32-2 and testObj.num_beats <= 32+2
+
+    with pytest.raises(FileNotFoundError):
+        Data(dataStr='hello', userInterval=10000, lazy=True).duration
+
+
+def test_ingestion():
+
+    """ tests that abnormal files are read into contiguous float64 arrays with string and missing cells interpolated
+    """
+    import numpy as np
+    from HRMdata import Data, interpolateNaN
+    for elem in ['test_data28.csv', 'test_data30.csv', 'test_data31.csv']:
+        tempObj = Data(dataStr=elem, userInterval=10000, lazy=True)
+        tempObj.load()
+        for values in (tempObj.times, tempObj.volt):
+            assert isinstance(values, np.ndarray) and values.dtype == np.float64
+            assert values.flags['C_CONTIGUOUS']
+            assert not np.isnan(values).any()
+
+    values = np.array([np.nan, 1.0, np.nan, 3.0, np.nan])
+    assert interpolateNaN(values) is values
+    assert values.tolist() == [1.0, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_reader():
+
+    """ tests that the numpy reader matches pandas on plain files, that auto sends abnormal files to pandas after
+    one scan and drops the parsed table once extracted, and that importing the module loads neither pandas nor
+    peakutils
+    """
+    import subprocess
+    import sys
+    import numpy as np
+    from HRMdata import Data, plainNumeric
+    fast = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False, reader='numpy')
+    slow = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False, reader='pandas')
+    assert fast.beats == slow.beats
+    assert np.array_equal(fast.volt, slow.volt)
+    assert fast.csvSamples is None and fast.csvDf is None
+    fast.read_csv()
+    assert fast.csvSamples is not None
+    assert plainNumeric(b'0,1e-3\n0.5,nan\n') and not plainNumeric(b'0,\n0.5,1\n')
+    assert not plainNumeric(b'0,1\n0.5,bad\n') and not plainNumeric(b'0,1\n,1\n')
+
+    fallback = Data(dataStr='test_data30.csv', userInterval=10000, lazy=True, cache=False)
+    fallback.load()
+    assert fallback.csvDf is not None and not np.isnan(fallback.volt).any()
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data30.csv', userInterval=10000, lazy=True, cache=False, reader='numpy').load()
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, reader='excel')
+
+    loaded = subprocess.check_output([sys.executable, '-c', 'import sys, HRMdata; '
+                                      'print("pandas" in sys.modules, "peakutils" in sys.modules)'])
+    assert loaded.split() == [b'False', b'False']
+
+
+def test_stageHooks():
+
+    """ tests that each pipeline stage is timed on the instance and reported to the hooks with its sample count
+    """
+    import HRMdata
+    calls = []
+    testObj = HRMdata.Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False,
+                           hooks=[lambda *args: calls.append(args)])
+    assert testObj.timings == {}
+    testObj.beats
+    stages = [elem[0] for elem in calls]
+    assert stages == ['loadCache', 'read_csv', 'extract_data', 'storeCache', 'modInterval', 'correlate',
+                      'findPeaks']
+    assert set(testObj.timings) == set(stages)
+    assert all(elem[1] >= 0 and isinstance(elem[3], int) for elem in calls)
+    assert calls[stages.index('read_csv')][2] == 10000
+
+    HRMdata.defaultHooks.append(lambda *args: calls.append(args))
+    try:
+        assert len(HRMdata.Data('test_data1.csv', 10000, lazy=True).hooks) == 1
+    finally:
+        HRMdata.defaultHooks.pop()
+    assert HRMdata.Data('test_data1.csv', 10000, lazy=True).hooks == []
+
+
+def test_multiLead(tmp_path):
+
+    """ tests that each lead of a multi-lead file gets the same results as that lead alone, with one batched
+    correlation, the first lead in the single lead fields, and a consensus heart rate
+    """
+    import numpy as np
+    from HRMcache import SampleCache
+    from HRMdata import Data
+    samples = np.genfromtxt('test_data1.csv', delimiter=',')
+    leads = [samples[:, 1], 0.5 * samples[:, 1] + 3, np.roll(samples[:, 1], 50)]
+    fileName = str(tmp_path / 'leads.csv')
+    np.savetxt(fileName, np.column_stack([samples[:, 0]] + leads), delimiter=',')
+    single = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False)
+    single.load()
+
+    for reader in ('numpy', 'pandas'):
+        testObj = Data(dataStr=fileName, userInterval=10000, lazy=True, cache=False, reader=reader)
+        assert testObj.numLeads == 3
+        assert testObj.leads.shape == (3, len(single.times))
+        assert np.allclose(testObj.leads.mean(axis=1), 0, atol=1e-3)
+        assert np.isclose(testObj.mean_hr_bpm, single.mean_hr_bpm)
+        assert np.allclose(testObj.lead_mean_hr_bpm, single.mean_hr_bpm, rtol=0.02)
+        assert testObj.lead_num_beats.tolist() == [single.num_beats] * 3
+        assert np.allclose(testObj.lead_voltage_extremes[1], np.array(single.voltage_extremes) * 0.5)
+        assert testObj.consensus_hr_bpm == np.median(testObj.lead_mean_hr_bpm)
+        assert list(testObj.timings).count('correlate') == 1
+        dataDict = testObj.toDict()
+        assert len(dataDict['Leads']) == 3 and 'Consensus HR (BPM)' in dataDict
+    assert 'Leads' not in single.toDict()
+
+    cache = SampleCache(cacheDir=str(tmp_path))
+    Data(dataStr=fileName, userInterval=10000, lazy=True, cache=cache).load()
+    cached = Data(dataStr=fileName, userInterval=10000, lazy=True, cache=cache)
+    assert cached.numLeads == 3 and cache.hits == 1
+    assert np.array_equal(cached.lead_num_beats, testObj.lead_num_beats)
+
+    rpeak = Data.fromSamples(samples[:, 0], leads, 10000, beatMethod='rpeak')
+    assert rpeak.lead_num_beats.tolist() == [rpeak.num_beats] * 3
+
+
+def test_sampleCache(tmp_path):
+
+    """ tests that the second analysis of a file is served from the binary cache with the same results, that the
+    cache is off by default and can be cleared, that the size bound evicts old entries, and that loads from many
+    threads are all counted
+    """
+    import os
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from HRMcache import SampleCache
+    from HRMdata import Data
+    cache = SampleCache(cacheDir=str(tmp_path))
+    first = Data(dataStr='test_data1.csv', userInterval=10000, cache=cache)
+    assert 'read_csv' in first.timings and cache.misses == 1
+    second = Data(dataStr='test_data1.csv', userInterval=10000, cache=cache)
+    assert 'read_csv' not in second.timings and cache.hits == 1
+    assert isinstance(second.volt, np.memmap)
+    assert second.mean_hr_bpm == first.mean_hr_bpm
+    assert second.beats == first.beats
+
+    bypass = Data(dataStr='test_data1.csv', userInterval=10000, cache=False)
+    assert 'read_csv' in bypass.timings and cache.hits == 1
+
+    cache.maxBytes = 1
+    cache.store('test_data3.csv', np.zeros((2, 10)))
+    assert len(cache.entries(str(tmp_path))) == 0
+
+    cache.maxBytes = 10 ** 9
+    cache.store('test_data3.csv', np.zeros((2, 10)))
+    assert cache.clear() == 1
+
+    shutil.copy('test_data1.csv', str(tmp_path / 'copy.csv'))
+    Data(dataStr=str(tmp_path / 'copy.csv'), userInterval=10000)
+    assert not os.path.exists(str(tmp_path / '.hrmcache'))
+    nextToFile = SampleCache()
+    Data(dataStr=str(tmp_path / 'copy.csv'), userInterval=10000, lazy=True, cache=nextToFile).load()
+    assert len(nextToFile.entries(str(tmp_path / '.hrmcache'))) == 1
+    assert nextToFile.clear() == 1
+    assert len(nextToFile.entries(str(tmp_path / '.hrmcache'))) == 0
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda index: cache.load('test_data1.csv'), range(400)))
+    assert cache.hits + cache.misses == 402
+
+
+def test_resultCache(tmp_path):
+
+    """ tests that a repeated analysis is served from memory, then from disk for a new cache, that the key follows
+    the file content and the parameters, and that both tiers are bounded
+    """
+    import os
+    import shutil
+    from HRMcache import ResultCache
+    from HRMdata import Data
+    cache = ResultCache(maxEntries=2, diskDir=str(tmp_path / 'results'))
+    first = cache.analyze('test_data1.csv', 10000)
+    assert cache.misses == 1
+    assert cache.analyze('test_data1.csv', 10000) is first and cache.hits == 1
+    expected = Data('test_data1.csv', 10000, lazy=True, logFile=None)
+    assert first['Mean HR (BPM)'] == expected.mean_hr_bpm
+    assert first['Beats'] == expected.beats
+
+    # same content under another name
+    copy = str(tmp_path / 'copy.csv')
+    shutil.copyfile('test_data1.csv', copy)
+    assert cache.analyze(copy, 10000) is first and cache.hits == 2
+    assert cache.analyze('test_data1.csv', 10000, thr=0.3) is not first and cache.misses == 2
+
+    fresh = ResultCache(diskDir=str(tmp_path / 'results'))
+    assert fresh.analyze('test_data1.csv', 10000) == first and fresh.diskHits == 1
+
+    cache.analyze('test_data3.csv', 10000)
+    assert len(cache) == 2
+    cache.maxDiskBytes = 1
+    cache.put('small', {})
+    assert not os.listdir(str(tmp_path / 'results'))
+    cache.clear()
+    assert len(cache) == 0 and cache.hits == 0
+
+
+def test_batch(tmp_path):
+
+    """ tests the batch API over a process pool, with per-file parameters, per-worker logs and a missing file
+    that is reported without aborting the batch
+    """
+    from HRMbatch import analyzeBatch
+    fileNames = ['test_data1.csv', 'test_data28.csv', 'hello.csv']
+    results = analyzeBatch(fileNames, 10000, mD=[200, 4, 200], workers=2, logDir=str(tmp_path))
+    assert [elem.file for elem in results] == fileNames
+    assert results[0].error is None
+    assert results[0].result['Mean HR (BPM)'] >= 78.35-5 and results[0].result['Mean HR (BPM)'] <= 78.35+5
+    assert results[1].result['Number of Beats'] >= 55-4 and results[1].result['Number of Beats'] <= 55+4
+    assert results[2].result is None and results[2].error.startswith('FileNotFoundError')
+    assert len(list(tmp_path.glob('hrmLog-*.txt'))) >= 1
+
+    serial = analyzeBatch('test_data[13].csv', 10000, workers=0)
+    assert [elem.file for elem in serial] == ['test_data1.csv', 'test_data3.csv']
+    assert serial[0].result == results[0].result
+
+
+def test_resultStore(tmp_path):
+
+    """ tests that batch results appended over several blocks and batches read back as the same results, that the
+    ragged beats survive, and that a truncated block is dropped
+    """
+    from HRMbatch import analyzeBatch
+    from HRMstore import ResultWriter, readResults
+    path = str(tmp_path / 'results.bin')
+    first = analyzeBatch(['test_data1.csv', 'hello.csv'], 10000, workers=0, store=path)
+    with ResultWriter(path, bufferSize=1) as writer:
+        for elem in analyzeBatch('test_data[23].csv', 10000, workers=0):
+            writer.append(elem.file, elem.result, elem.error)
+    results = readResults(path)
+    assert len(results) == 4
+    assert list(results.files) == ['test_data1.csv', 'hello.csv', 'test_data2.csv', 'test_data3.csv']
+    assert results.toDict(0) == first[0].result
+    assert results.toDict(1) is None and results.errors[1].startswith('FileNotFoundError')
+    assert len(results.beats(3)) == results.table['num_beats'][3]
+
+    results.savez(str(tmp_path / 'results.npz'))
+    assert readResults(str(tmp_path / 'results.npz')).toDict(3) == results.toDict(3)
+
+    with open(path, 'r+b') as out_file:
+        out_file.truncate(out_file.seek(0, 2) - 10)
+    assert len(readResults(path)) == 3
+
+
+def test_export():
+
+    """ tests that export gives a slotted record with the same results, releases the samples, and that records
+    gather into a ResultTable
+    """
+    from array import array
+    from HRMdata import Data
+    from HRMstore import ResultTable
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True)
+    expected = testObj.toDict()
+    result = testObj.export()
+    assert not hasattr(result, '__dict__')
+    assert isinstance(result.beats, array) and result.beats.typecode == 'd'
+    assert result.toDict() == expected and result.voltage_extremes == tuple(expected['Voltage Extremes'])
+    assert testObj.times is None and testObj.leads is None and testObj.csvSamples is None
+    assert testObj.toDict() == expected
+
+    kept = testObj.export(release=False)
+    assert testObj.times is not None
+    table = ResultTable.fromResults([result, kept])
+    assert len(table) == 2 and table.toDict(1) == expected
+
+
+def test_threads(tmp_path):
+
+    """ tests that construction leaves the logging configuration alone, that log files are closed with their
+    instances, that a thread pool batch matches the serial one with its JSON files in outputDir, and that an
+    instance shared between threads loads and correlates once
+    """
+    import gc
+    import logging
+    import os
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from HRMbatch import analyzeBatch
+    from HRMdata import Data
+    handlers = list(logging.getLogger().handlers)
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, outputDir=str(tmp_path),
+                   logFile=str(tmp_path / 'one.txt'))
+    assert logging.getLogger().handlers == handlers
+    assert os.path.exists(str(tmp_path / 'test_data1.json'))
+
+    threads = threading.active_count()
+    for index in range(20):
+        Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, logFile=str(tmp_path / ('job%d.txt' % index)))
+    gc.collect()
+    assert threading.active_count() == threads
+    with open(str(tmp_path / 'job0.txt')) as in_file:
+        assert 'Lazy mode' in in_file.read()
+    assert testObj.jsonPath() == os.path.join(str(tmp_path), 'test_data1.json')
+
+    serial = analyzeBatch('test_data[123].csv', 10000, workers=0)
+    threaded = analyzeBatch('test_data[123].csv', 10000, workers=4, pool='thread', logDir=str(tmp_path / 'logs'),
+                            writeJson=True, outputDir=str(tmp_path / 'json'), cache=False)
+    assert [elem.result for elem in threaded] == [elem.result for elem in serial]
+    assert len(os.listdir(str(tmp_path / 'json'))) == 3
+    assert len(os.listdir(str(tmp_path / 'logs'))) == 1
+    with pytest.raises(ValueError):
+        analyzeBatch('test_data1.csv', 10000, pool='fiber')
+
+    stages = []
+    shared = Data(dataStr='test_data3.csv', userInterval=10000, lazy=True, cache=False,
+                  hooks=[lambda stage, *args: stages.append(stage)])
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        beats = list(executor.map(lambda index: shared.beats, range(8)))
+    assert all(elem == beats[0] for elem in beats)
+    assert stages.count('read_csv') == 1 and stages.count('correlate') == 1
+
+
+def test_preprocess():
+
+    """ tests uniform resampling, baseline wander removal on every lead, decimation before the autocorrelation and
+    the validation of the preprocessing options
+    """
+    import numpy as np
+    from HRMdata import Data, uniformGrid
+    times = np.cumsum(np.r_[0, np.tile([0.002, 0.003], 500)])
+    grid, leads = uniformGrid(times, np.vstack([times, 2 * times]))
+    assert np.allclose(np.diff(grid), grid[1] - grid[0])
+    assert np.allclose(leads, np.vstack([grid, 2 * grid]))
+
+    times = np.arange(0, 20, 1 / 250)
+    beat = np.sin(2 * np.pi * times)
+    drift = 3 * np.sin(2 * np.pi * 0.05 * times)
+    testObj = Data.fromSamples(times, [beat + drift, drift - beat], 10000, bandpass=(0.5, 40))
+    testObj.load()
+    assert np.allclose(testObj.leads[0], beat[:len(testObj.times)], atol=0.1)
+    assert np.allclose(testObj.leads[1], -beat[:len(testObj.times)], atol=0.1)
+    assert 'preprocess' in testObj.timings
+
+    full = Data(dataStr='test_data31.csv', userInterval=2000, thr=0.1, lazy=True, cache=False)
+    decimated = Data(dataStr='test_data31.csv', userInterval=2000, thr=0.1, targetRate=240,
+                     bandpass=(0.5, 40), lazy=True, cache=False)
+    full.load()
+    decimated.load()
+    assert len(decimated.volt) == (len(full.volt) + 2) // 3
+    assert np.allclose(np.diff(decimated.times), decimated.times[1] - decimated.times[0])
+    assert decimated.num_beats == full.num_beats
+    assert abs(decimated.mean_hr_bpm - full.mean_hr_bpm) < 1
+    assert decimated.sweep([0.1], [200])['num_beats'][0] == full.num_beats
+    plain = Data(dataStr='test_data31.csv', userInterval=2000, thr=0.1, targetRate=240, lazy=True, cache=False)
+    assert plain.num_beats == full.num_beats and abs(plain.mean_hr_bpm - full.mean_hr_bpm) < 1
+    assert Data(dataStr='test_data1.csv', userInterval=10000, bandpass=(0.5, 1000), lazy=True,
+                cache=False).num_beats > 0
+    highPass = Data(dataStr='test_data1.csv', userInterval=10000, bandpass=(200, None), lazy=True)
+    plain = Data(dataStr='test_data1.csv', userInterval=10000, uniform=True, lazy=True)
+    assert highPass.num_beats == plain.num_beats
+    # 100 Hz is below the 360 Hz Nyquist frequency of the recording, above the 51 Hz one of the decimated signal
+    assert Data(dataStr='test_data31.csv', userInterval=2000, thr=0.1, targetRate=100, bandpass=(100, None),
+                lazy=True).num_beats > 0
+
+    for kwargs in [{'bandpass': (40, 0.5)}, {'bandpass': 5}, {'bandpass': (0, 40)}, {'targetRate': 0}]:
+        with pytest.raises(ValueError):
+            Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, **kwargs)
+
+
+def test_stream():
+
+    """ tests the streaming analyzer on a recording fed in chunks, checking it finds the same beats as a single chunk
+    and reports each beat once
+    """
+    import numpy as np
+    from HRMstream import StreamAnalyzer, tailChunks
+    analyzer = StreamAnalyzer(capacity=4096)
+    beats = []
+    for update in analyzer.run(tailChunks('test_data1.csv', chunkSize=500, follow=False)):
+        beats.extend(update.new_beats)
+    assert analyzer.num_beats == len(beats)
+    assert analyzer.num_beats >= 32-2 and analyzer.num_beats <= 32+2
+    assert analyzer.mean_hr_bpm >= 73.74-5 and analyzer.mean_hr_bpm <= 73.74+5
+    assert np.all(np.diff(beats) > 0)
+    assert analyzer.size == 4096
+
+    with pytest.raises(ValueError):
+        StreamAnalyzer(capacity=100, mD=200)
+
+
+def test_windowedHR():
+
+    """ tests the sliding window heart rate series against the whole-strip analysis, and that batching the FFT
+    does not change the result
+    """
+    import numpy as np
+    from HRMdata import Data
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True)
+    series = testObj.windowedHR(window=10, hop=2)
+    assert series.dtype.names == ('window_start', 'bpm', 'beat_count')
+    assert len(series) == 9
+    assert np.allclose(series['window_start'], np.arange(0, 18, 2), atol=0.01)
+    assert np.all(np.abs(series['bpm'] - 73.74) < 5)
+    assert np.all(np.abs(series['beat_count'] - 12) <= 2)
+
+    oneByOne = testObj.windowedHR(window=10, hop=2, batchSize=1)
+    assert np.allclose(oneByOne['bpm'], series['bpm'])
+
+    with pytest.raises(ValueError):
+        testObj.windowedHR(window=100, hop=2)
+
+
+def test_sweep():
+
+    """ tests that every row of a threshold and min distance sweep matches a separate analysis with those parameters
+    """
+    import numpy as np
+    from HRMdata import Data
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True)
+    grid = testObj.sweep([0.1, 0.18, 0.4], [100, 200])
+    assert grid.dtype.names == ('thr', 'mD', 'mean_hr_bpm', 'num_beats')
+    assert len(grid) == 6
+    for row in grid:
+        single = Data(dataStr='test_data1.csv', userInterval=10000, thr=row['thr'], mD=int(row['mD']), lazy=True)
+        assert row['num_beats'] == single.num_beats
+        if row['num_beats'] > 2:
+            assert np.isclose(row['mean_hr_bpm'], single.mean_hr_bpm)
+    assert np.isnan(grid['mean_hr_bpm'][-1])
+    empty = testObj.sweep([0.5], [100000])
+    assert empty['num_beats'][0] == 0 and np.isnan(empty['mean_hr_bpm'][0])
+    short = Data(dataStr='test_data1.csv', userInterval=1.5, lazy=True).sweep([0.99], [200])
+    assert short['num_beats'][0] == 0 and np.isnan(short['mean_hr_bpm'][0])
+
+    with pytest.raises(ValueError):
+        testObj.sweep([0], [200])
+    with pytest.raises(ValueError):
+        testObj.sweep([0.18], [-1])
+
+
+def test_rpeaks():
+
+    """ tests direct R-peak detection on a recording and on a synthetic, irregularly sampled signal with a changing
+    rhythm, where every beat time must be recovered through the times array
+    """
+    import numpy as np
+    from HRMdata import Data, detectRPeaks
+    testObj = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, beatMethod='rpeak')
+    assert testObj.num_beats >= 34-2 and testObj.num_beats <= 34+2
+    assert testObj.mean_hr_bpm >= 73.74-5 and testObj.mean_hr_bpm <= 73.74+5
+    assert len(testObj.beats) == testObj.num_beats
+    assert np.all(np.diff(testObj.beats) > 0.2)
+
+    rng = np.random.RandomState(0)
+    times = np.cumsum(rng.uniform(0.002, 0.004, 6000))
+    beatTimes = np.concatenate((np.arange(1, 8, 0.8), np.arange(8, times[-1] - 1, 0.5)))
+    volt = sum(np.exp(-((times - elem) / 0.01) ** 2) for elem in beatTimes)
+    volt += 0.2 * np.sin(2 * np.pi * 0.3 * times)
+    found = times[detectRPeaks(times, volt - volt.mean())]
+    assert len(found) == len(beatTimes)
+    assert np.all(np.abs(found - beatTimes) < 0.01)
+
+    for beatTimes in ([], [5]):
+        volt = sum((np.exp(-((times - elem) / 0.01) ** 2) for elem in beatTimes), np.zeros(len(times)))
+        sparse = Data.fromSamples(times, volt, 10000, beatMethod='rpeak')
+        assert sparse.num_beats == len(beatTimes)
+        assert np.isnan(sparse.mean_hr_bpm)
+
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data1.csv', userInterval=10000, beatMethod='hello')
+
+
+def test_intervalWindow():
+
+    """ tests analysis of a middle segment [intervalStart, userInterval) and that trimming keeps views of the data
+    """
+    import numpy as np
+    from HRMdata import Data
+    full = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, cache=False)
+    full.load()
+    middle = Data(dataStr='test_data1.csv', userInterval=20, intervalStart=10, lazy=True, cache=False)
+    middle.load()
+    assert middle.times[0] >= 10 and middle.times[-1] < 20
+    assert middle.times[0] - 10 < 0.01 and 20 - middle.times[-1] < 0.01
+    assert np.shares_memory(middle.volt, middle.volt.base)
+    assert middle.num_beats >= 12-2 and middle.num_beats <= 12+2
+    assert np.allclose(middle.volt, full.volt[(full.times >= 10) & (full.times < 20)])
+    assert 10 <= middle.beats[0] < 12
+    assert abs(middle.beats[0] - full.beats[0] - 10) < 1
+
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data1.csv', userInterval=100000, intervalStart=50, lazy=True).load()
+
+    with pytest.raises(ValueError):
+        Data(dataStr='test_data1.csv', userInterval=10, intervalStart=10)
+    with pytest.raises(TypeError):
+        Data(dataStr='test_data1.csv', userInterval=10, intervalStart='hello')
+
+
+def test_chunked(tmp_path):
+
+    """ tests that the out-of-core analysis matches Data with R-peak detection, that a multi-lead file is analyzed on
+    its first lead, and that gaps are interpolated across chunk boundaries the same way as for a whole file
+    """
+    import numpy as np
+    from HRMchunked import analyzeChunked, fillGaps, readChunks
+    from HRMdata import Data
+    whole = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True, beatMethod='rpeak').toDict()
+    chunked = analyzeChunked('test_data1.csv', 10000, chunkSize=1000)
+    assert chunked['Number of Beats'] == whole['Number of Beats']
+    assert np.allclose(chunked['Beats'], whole['Beats'])
+    assert np.allclose(chunked['Voltage Extremes'], whole['Voltage Extremes'])
+    assert chunked['Duration'] == whole['Duration']
+
+    testObj = Data(dataStr='test_data28.csv', userInterval=10000, lazy=True, cache=False)
+    testObj.load()
+    samples = np.concatenate(list(fillGaps(readChunks('test_data28.csv', chunkSize=331))))
+    assert not np.isnan(samples).any()
+    assert np.allclose(samples[:len(testObj.times), 0], testObj.times)
+
+    leads = np.loadtxt('test_data1.csv', delimiter=',')
+    np.savetxt(str(tmp_path / 'leads.csv'), np.column_stack((leads, -leads[:, 1])), delimiter=',')
+    multiLead = analyzeChunked(str(tmp_path / 'leads.csv'), 10000, chunkSize=1000)
+    assert multiLead['Number of Beats'] == chunked['Number of Beats']
+    assert np.allclose(multiLead['Beats'], chunked['Beats'])
+
+    with pytest.raises(FileNotFoundError):
+        analyzeChunked('hello', 10000)
+
+
+def test_service():
+
+    """ tests the analysis service: results match Data for a path and for uploaded samples, bodies are parsed by
+    the worker rather than the event loop, bad jobs are answered with an error, and a full queue is refused with 503
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from bench_HRM import postJSON
+    from HRMdata import Data
+    from HRMservice import AnalysisService, runJob
+    expected = Data(dataStr='test_data1.csv', userInterval=10000, lazy=True).toDict()
+    raw = np.genfromtxt('test_data1.csv', delimiter=',')
+
+    jobs = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+
+        def submit(self, fn, *args, **kwargs):
+            if fn is runJob:
+                jobs.extend(args)
+            return super().submit(fn, *args, **kwargs)
+
+    async def scenario():
+        service = AnalysisService(port=0, workers=1, queueSize=1, executor=RecordingExecutor(1))
+        await service.start()
+        status, body = await postJSON(service.host, service.port, '/analyze',
+                                      {'path': 'test_data1.csv', 'userInterval': 10000})
+        assert status == 200 and body == expected
+        status, body = await postJSON(service.host, service.port, '/analyze',
+                                      {'samples': raw.tolist(), 'userInterval': 10000})
+        assert status == 200 and body['Number of Beats'] == expected['Number of Beats']
+        status, body = await postJSON(service.host, service.port, '/analyze', {'path': 'hello'})
+        assert status == 422 and body['error'].startswith('FileNotFoundError')
+        status, body = await postJSON(service.host, service.port, '/analyze', [1, 2])
+        assert status == 400
+        assert len(jobs) == 4 and all(isinstance(elem, bytes) for elem in jobs)
 
+        # with the worker task stopped, one job fills the queue and the next one is refused
+        for task in service.tasks:
+            task.cancel()
+        waiting = asyncio.ensure_future(postJSON(service.host, service.port, '/analyze', {'path': 'test_data1.csv'}))
+        await asyncio.sleep(0.2)
+        status, body = await postJSON(service.host, service.port, '/analyze', {'path': 'test_data1.csv'})
+        assert status == 503
+        waiting.cancel()
+        await service.close()
 
+    asyncio.run(scenario())